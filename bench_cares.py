@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+
+"""Benchmark for decoding host entries in "cares.HostCallback\""""
+
+from time import perf_counter
+from ctypes import (
+    c_char, c_char_p, POINTER, cast, addressof, create_string_buffer,
+    pointer)
+from socket import AF_INET, AF_INET6, inet_ntop
+import cares
+
+def main(*, iterations=20000, addresses=32):
+    """Compare callbacks per second for each address form
+    
+    The "indexed" case decodes one address at a time through ctypes
+    indexing, as the callback originally did.
+    """
+    
+    iterations = int(iterations)
+    addresses = int(addresses)
+    callback = cares.HostCallback()
+    for [family, length] in ((AF_INET, 4), (AF_INET6, 16)):
+        hostent = make_hostent(family, length, addresses)
+        for form in ("indexed", "text", "packed", "ip"):
+            start = perf_counter()
+            if form == "indexed":
+                for _ in range(iterations):
+                    indexed_decode(hostent)
+            else:
+                form = cares.ADDRESS_FORMS[form]
+                for _ in range(iterations):
+                    arg = callback.arm((form, ignore))
+                    callback.proxy(arg.value, 0, 0, hostent)
+            rate = iterations / (perf_counter() - start)
+            print("Family {}, {} addresses, {}: {:.0f} callbacks/s".format(
+                family, addresses, form_name(form), rate))
+
+def form_name(form):
+    for [name, value] in cares.ADDRESS_FORMS.items():
+        if value is form:
+            return name
+    return form
+
+def make_hostent(family, length, count):
+    data = create_string_buffer(bytes(range(length)) * count)
+    addr_list = (POINTER(c_char) * (count + 1))()
+    for i in range(count):
+        addr_list[i] = cast(addressof(data) + i * length, POINTER(c_char))
+    aliases = (c_char_p * 1)()
+    hostent = cares.HostEntC(h_name=b"bench.test",
+        h_aliases=cast(aliases, POINTER(c_char_p)),
+        h_addrtype=family, h_length=length,
+        h_addr_list=cast(addr_list, POINTER(POINTER(c_char))))
+    hostent._buffers = (data, addr_list, aliases)
+    return pointer(hostent)
+
+def indexed_decode(hostent):
+    addr_list = []
+    while True:
+        addr = hostent.contents.h_addr_list[len(addr_list)]
+        if not addr:
+            break
+        addr_list.append(inet_ntop(hostent.contents.h_addrtype,
+            addr[:hostent.contents.h_length]))
+    return addr_list
+
+def ignore(status, timeouts, hostent):
+    pass
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
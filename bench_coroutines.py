@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+
+"""Benchmarks for the "coroutines.Thread" scheduler"""
+
+from time import perf_counter
+from coroutines import Thread, Callback
+
+def main(*, iterations=100000):
+    """Measure context switches per second with deep coroutine stacks
+    
+    A "switch" resumes the innermost of "depth" nested sub-coroutines
+    from an event. A "call" enters and returns through "depth" nested
+    sub-coroutines without waiting.
+    """
+    
+    iterations = int(iterations)
+    for depth in (1, 10, 100):
+        events = list()
+        thread = Thread(nest(depth, wait_loop(events, iterations)))
+        start = perf_counter()
+        for _ in range(iterations):
+            events.pop()()
+        rate = iterations / (perf_counter() - start)
+        print("Depth {}: {:.0f} switches/s".format(depth, rate))
+        thread.close()
+        
+        start = perf_counter()
+        Thread(call_loop(depth, iterations // depth))
+        rate = iterations // depth * depth / (perf_counter() - start)
+        print("Depth {}: {:.0f} calls/s".format(depth, rate))
+
+def nest(depth, inner):
+    if depth > 1:
+        return (yield nest(depth - 1, inner))
+    return (yield inner)
+
+def wait_loop(events, iterations):
+    for _ in range(iterations):
+        event = Callback()
+        events.append(event)
+        yield event
+
+def call_loop(depth, iterations):
+    for _ in range(iterations):
+        yield nest(depth, leaf())
+
+def leaf():
+    return
+    yield
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+
+"""Benchmarks for "coroutines.http" response parsing"""
+
+import asyncio
+import socket
+from time import perf_counter
+from coroutines.http import HTTPConnection, Reader
+from coroutines.socket import Socket
+
+RESPONSE = (
+    b"HTTP/1.1 200 OK\r\n" +
+    b"".join("X-Header-{}: value {}\r\n".format(i, i).encode("ascii")
+        for i in range(20)) +
+    b"Content-Length: 0\r\n"
+    b"\r\n"
+)
+
+CHUNKS = 10000
+CHUNKED = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"\r\n" +
+    b"".join(b"%x\r\n%s\r\n" % (len(event), event)
+        for event in (b"data: {\"event\": %d}\n\n" % i
+            for i in range(CHUNKS))) +
+    b"0\r\n\r\n"
+)
+
+def main(*, iterations=2000):
+    """Compare headers parsed per second with and without buffering
+    
+    The unbuffered case receives one byte per recv() call, like the
+    original byte-at-a-time parser.
+    """
+    
+    iterations = int(iterations)
+    headers = RESPONSE.count(b"\n") - 2
+    loop = asyncio.new_event_loop()
+    try:
+        for [name, bufsize] in (
+            ("byte-at-a-time", 1),
+            ("buffered", Reader.BUFFER_SIZE),
+        ):
+            elapsed = loop.run_until_complete(
+                parse_responses(loop, iterations, bufsize))
+            rate = headers * iterations / elapsed
+            print("{}: {:.0f} headers/s".format(name, rate))
+        elapsed = loop.run_until_complete(read_chunked(loop))
+        print("chunked body: {:.0f} chunks/s".format(CHUNKS / elapsed))
+    finally:
+        loop.close()
+
+async def parse_responses(loop, iterations, bufsize):
+    [a, b] = socket.socketpair()
+    with a, b:
+        sock = Socket(fileno=a.detach(), loop=loop)
+        conn = HTTPConnection(sock)
+        conn.reader = Reader(sock, bufsize)
+        elapsed = 0
+        for _ in range(iterations):
+            b.sendall(RESPONSE)  # Fits in socket buffer; recv never blocks
+            start = perf_counter()
+            await conn.getresponse()
+            elapsed += perf_counter() - start
+        sock.close()
+    return elapsed
+
+async def read_chunked(loop):
+    """Reads a body of many small chunks, as streamed events would be"""
+    [a, b] = socket.socketpair()
+    with a, b:
+        sock = Socket(fileno=a.detach(), loop=loop)
+        conn = HTTPConnection(sock)
+        sender = loop.run_in_executor(None, b.sendall, CHUNKED)
+        start = perf_counter()
+        response = await conn.getresponse()
+        while await response.read(0x10000):
+            pass
+        elapsed = perf_counter() - start
+        await sender
+        sock.close()
+    return elapsed
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+
+"""Compare "coroutines.selector.EventLoop" with the stock asyncio loop"""
+
+import asyncio
+import socket
+from time import perf_counter
+from coroutines.selector import EventLoop
+from coroutines.socket import Socket
+
+def main(*, pairs=200, messages=50, callbacks=200000):
+    """Measure throughput of each event loop
+    
+    Each of "pairs" socket pairs echoes "messages" one-byte messages
+    concurrently, using "coroutines.socket" persistent sockets. Separately,
+    "callbacks" call_soon() callbacks are chained one after another.
+    """
+    
+    pairs = int(pairs)
+    messages = int(messages)
+    callbacks = int(callbacks)
+    for [name, new_loop] in (
+        ("asyncio", asyncio.new_event_loop),
+        ("coroutines.selector", EventLoop),
+    ):
+        loop = new_loop()
+        try:
+            elapsed = loop.run_until_complete(
+                echo_pairs(loop, pairs, messages))
+            print("{}: {:.0f} messages/s".format(
+                name, pairs * messages / elapsed))
+            elapsed = loop.run_until_complete(chain(loop, callbacks))
+            print("{}: {:.0f} callbacks/s".format(name, callbacks / elapsed))
+        finally:
+            loop.close()
+
+async def echo_pairs(loop, pairs, messages):
+    sockets = list()
+    for _ in range(pairs):
+        pair = socket.socketpair()
+        sockets.append(tuple(Socket(fileno=sock.detach(), loop=loop,
+            persistent=True) for sock in pair))
+    try:
+        start = perf_counter()
+        await asyncio.gather(*(round_trips(a, b, messages)
+            for [a, b] in sockets))
+        return perf_counter() - start
+    finally:
+        for pair in sockets:
+            for sock in pair:
+                sock.close()
+
+async def round_trips(a, b, messages):
+    for _ in range(messages):
+        await a.sendall(b"x")
+        await b.recv(1)
+        await b.sendall(b"x")
+        await a.recv(1)
+
+async def chain(loop, count):
+    done = loop.create_future()
+    remaining = count
+    def callback():
+        nonlocal remaining
+        remaining -= 1
+        if remaining:
+            loop.call_soon(callback)
+        else:
+            done.set_result(None)
+    start = perf_counter()
+    loop.call_soon(callback)
+    await done
+    return perf_counter() - start
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
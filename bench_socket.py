@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+
+"""Benchmarks for "coroutines.socket" operations"""
+
+import asyncio
+import socket
+from time import perf_counter
+from coroutines.socket import Socket
+
+def main(*, iterations=20000):
+    """Measure recv/send round-trip latency over a socket pair
+    
+    A one-byte message is echoed back and forth, so every recv() has to
+    wait for the event loop.
+    """
+    
+    iterations = int(iterations)
+    loop = asyncio.new_event_loop()
+    try:
+        for persistent in (False, True):
+            elapsed = loop.run_until_complete(
+                round_trips(loop, iterations, persistent))
+            print("persistent={}: {:.1f} us per round trip".format(
+                persistent, elapsed / iterations * 1e6))
+        elapsed = loop.run_until_complete(
+            asyncio_round_trips(loop, iterations))
+        print("asyncio sock_recv: {:.1f} us per round trip".format(
+            elapsed / iterations * 1e6))
+    finally:
+        loop.close()
+
+async def round_trips(loop, iterations, persistent):
+    [a, b] = socket.socketpair()
+    a = Socket(fileno=a.detach(), loop=loop, persistent=persistent)
+    b = Socket(fileno=b.detach(), loop=loop, persistent=persistent)
+    with a, b:
+        async def echo():
+            while True:
+                data = await b.recv(1)
+                if not data:
+                    break
+                await b.sendall(data)
+        echoer = loop.create_task(echo())
+        start = perf_counter()
+        for _ in range(iterations):
+            await a.sendall(b"x")
+            await a.recv(1)
+        elapsed = perf_counter() - start
+        a.sock.shutdown(socket.SHUT_WR)
+        await echoer
+    return elapsed
+
+async def asyncio_round_trips(loop, iterations):
+    [a, b] = socket.socketpair()
+    with a, b:
+        a.setblocking(False)
+        b.setblocking(False)
+        async def echo():
+            while True:
+                data = await loop.sock_recv(b, 1)
+                if not data:
+                    break
+                await loop.sock_sendall(b, data)
+        echoer = loop.create_task(echo())
+        start = perf_counter()
+        for _ in range(iterations):
+            await loop.sock_sendall(a, b"x")
+            await loop.sock_recv(a, 1)
+        elapsed = perf_counter() - start
+        a.shutdown(socket.SHUT_WR)
+        await echoer
+    return elapsed
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
@@ -7,17 +7,21 @@ from __future__ import division
 
 import atexit
 import math
-import weakref
+import os
+from time import time
 
 from ctypes import (
     CDLL,
-    c_char_p, c_void_p, c_int, c_char, c_ushort, c_long,
-    byref, CFUNCTYPE, POINTER, Structure,
+    c_char_p, c_void_p, c_int, c_char, c_ushort, c_long, c_uint, c_size_t,
+    byref, CFUNCTYPE, POINTER, Structure, string_at, cast,
 )
 from misc import exc_sink
-from functions import weakmethod
 from collections import namedtuple
-from socket import inet_ntop
+from itertools import count
+from functools import partial
+from socket import inet_ntop, inet_pton, inet_ntoa
+from ipaddress import IPv4Address, IPv6Address
+import struct
 
 import socket
 globals().update((k, v)
@@ -37,11 +41,157 @@ HostEnt = namedtuple("HostEnt",
 
 lib = CDLL("libcares.so.2")
 
-def library_init():
-    check(lib.ares_library_init(1))
+# Status codes
+SUCCESS = 0
+ENODATA = 1
+ENOTFOUND = 4
+EDESTRUCTION = 16
+ECANCELLED = 24
+
+# DNS class and record types for query() and search()
+C_IN = 1
+T_A = 1
+T_PTR = 12
+T_TXT = 16
+T_AAAA = 28
+T_SRV = 33
+
+# getnameinfo() flags
+NI_NOFQDN = 1 << 0
+NI_NUMERICHOST = 1 << 1
+NI_NAMEREQD = 1 << 2
+NI_NUMERICSERV = 1 << 3
+NI_DGRAM = 1 << 4
+NI_LOOKUPHOST = 1 << 8
+NI_LOOKUPSERVICE = 1 << 9
+
+initialized = False
+
+def library_init(snapshot_path=None):
+    """Initializes the library, which is done when this module is imported
+    
+    If "snapshot_path" is given, unexpired answers are loaded into
+    "snapshot" from the file, new answers are recorded, and the file is
+    rewritten at exit."""
+    
+    global initialized, snapshot_file, _save_registered
+    if not initialized:
+        check(lib.ares_library_init(1))
+        initialized = True
+    if snapshot_path is not None:
+        snapshot_file = snapshot_path
+        load_snapshot(snapshot_path)
+        if not _save_registered:
+            atexit.register(_save_at_exit)
+            _save_registered = True
 
 def library_cleanup():
+    global initialized
     lib.ares_library_cleanup()
+    initialized = False
+
+# Answers shared between processes through a snapshot file. Expiry times
+# are wall-clock times from time.time().
+snapshot = dict()  # {(name, family): (expiry, HostEnt)}, oldest first
+snapshot_file = None  # Answers are only recorded once this is set
+snapshot_size = 1000
+_save_registered = False
+SNAPSHOT_MAGIC = b"c-ares snapshot\x01"
+# Expiry, family, addrtype, name length, address count
+SNAPSHOT_ENTRY = struct.Struct("!dBBHH")
+
+def load_snapshot(path):
+    """Adds unexpired entries from a file written by save_snapshot()
+    
+    A missing or corrupt file is ignored."""
+    
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+        entries = parse_snapshot(data, time())
+    except (EnvironmentError, ValueError, LookupError, UnicodeError,
+            struct.error):
+        return
+    snapshot.update(entries)
+    _trim_snapshot()
+
+def record_snapshot(key, expiry, hostent):
+    """Keeps an answer for save_snapshot(), if a snapshot file is in use
+    
+    Only the "snapshot_size" most recently recorded answers are kept."""
+    
+    if snapshot_file is None:
+        return
+    snapshot.pop(key, None)
+    snapshot[key] = (expiry, hostent)
+    _trim_snapshot()
+
+def _trim_snapshot():
+    while len(snapshot) > snapshot_size:
+        del snapshot[next(iter(snapshot))]
+
+def parse_snapshot(data, now):
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Not a snapshot file")
+    entries = dict()
+    pos = len(SNAPSHOT_MAGIC)
+    while pos < len(data):
+        [expiry, family, addrtype, size, count] = (
+            SNAPSHOT_ENTRY.unpack_from(data, pos))
+        pos += SNAPSHOT_ENTRY.size
+        name = data[pos:pos + size]
+        pos += size
+        length = SOCKADDR_ADDRESS[addrtype][1]
+        addresses = data[pos:pos + count * length]
+        pos += count * length
+        if len(name) < size or len(addresses) < count * length:
+            raise ValueError("Truncated snapshot")
+        if expiry <= now:
+            continue
+        addr_list = [inet_ntop(addrtype, addresses[i:i + length])
+            for i in range(0, len(addresses), length)]
+        hostent = HostEnt(name=name, aliases=[], addrtype=addrtype,
+            length=length, addr_list=addr_list)
+        entries[(name.decode(), family)] = (expiry, hostent)
+    return entries
+
+def save_snapshot(path):
+    """Writes unexpired entries from "snapshot" to a file
+    
+    The file is replaced atomically, so that a concurrent load sees
+    either the old or new snapshot."""
+    
+    now = time()
+    chunks = [SNAPSHOT_MAGIC]
+    for [[name, family], [expiry, hostent]] in list(snapshot.items()):
+        if expiry <= now:
+            del snapshot[(name, family)]
+            continue
+        name = name.encode()
+        chunks.append(SNAPSHOT_ENTRY.pack(expiry, family, hostent.addrtype,
+            len(name), len(hostent.addr_list)))
+        chunks.append(name)
+        chunks.extend(inet_pton(hostent.addrtype, address)
+            for address in hostent.addr_list)
+    temp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp, "wb") as file:
+            file.writelines(chunks)
+        os.replace(temp, path)
+    except:
+        try:
+            os.remove(temp)
+        except EnvironmentError:
+            pass
+        raise
+
+def _save_at_exit():
+    if snapshot_file is None:
+        return
+    try:
+        save_snapshot(snapshot_file)
+    except EnvironmentError:
+        pass  # Only costs fresh lookups next time
 
 def check(res):
     if res:
@@ -60,7 +210,11 @@ def version():
 class Channel:
     def __init__(self, **options):
         self.channel = c_void_p()
-        self.host_callback_refs = set()
+        # One shared C callback of each type, rather than one per query
+        self.host_callback = HostCallback()
+        self.addrinfo_callback = AddrInfoCallback()
+        self.nameinfo_callback = NameInfoCallback()
+        self.query_callback = QueryCallback()
         
         opt_struct = Options()
         optmask = 0
@@ -78,15 +232,96 @@ class Channel:
         check(lib.ares_init_options(byref(self.channel),
             byref(opt_struct), optmask))
     
+    def destroy(self):
+        """Cancels any pending queries and frees the channel
+        
+        The callbacks of the queries are called with ECANCELLED. Further
+        calls have no effect."""
+        if self.channel:
+            lib.ares_cancel(self.channel)
+            lib.ares_destroy(self.channel)
+            self.channel = c_void_p()
+    
     def __del__(self):
-        lib.ares_destroy(self.channel)
+        self.destroy()
     
-    def gethostbyname(self, name, family, callback):
-        callback = HostCallback().arm(self.host_callback_refs, callback)
+    def gethostbyname(self, name, family, callback, form="text"):
+        """Looks up addresses, calling back with (status, timeouts, hostent)
+        
+        The "form" of the addresses in "hostent.addr_list" is "text" for
+        strings, "packed" for byte strings in network order, or "ip" for
+        "ipaddress" objects."""
+        
+        arg = self.host_callback.arm((ADDRESS_FORMS[form], callback))
         lib.ares_gethostbyname(self.channel, c_char_p(name.encode()),
-            c_int(family), callback, None)
+            c_int(family), self.host_callback.cfunc, arg)
+    
+    def getaddrinfo(self, name, family, callback):
+        """Looks up addresses, calling back with (status, timeouts, nodes)
+        
+        Each node is a tuple (family, address, ttl). The hosts file is
+        consulted as well as DNS."""
+        
+        hints = AddrInfoHints(ai_family=family)
+        arg = self.addrinfo_callback.arm(callback)
+        lib.ares_getaddrinfo(self.channel, c_char_p(name.encode()), None,
+            byref(hints), self.addrinfo_callback.cfunc, arg)
+    
+    def getaddrinfo_many(self, queries, callback, family=AF_UNSPEC, *,
+            limit=100, finished=None):
+        """Looks up many names, with at most "limit" queries in flight
+        
+        Each query is a name, or a tuple (name, family). As each lookup
+        completes, in any order, the callback is called with (query, status,
+        timeouts, nodes), as for getaddrinfo(). Further queries are only
+        taken from the iterable as earlier ones complete. The optional
+        "finished" callback is called with no arguments after the last
+        lookup completes."""
+        
+        batch = AddrInfoBatch(self, iter(queries), family, callback,
+            limit, finished)
+        batch.start()
+    
+    def set_servers(self, servers):
+        """Sets DNS servers from a sequence of (address, port) tuples"""
+        csv = list()
+        for [address, port] in servers:
+            if ":" in address:
+                address = "[{}]".format(address)
+            csv.append("{}:{}".format(address, port))
+        check(lib.ares_set_servers_ports_csv(self.channel,
+            c_char_p(",".join(csv).encode("ascii"))))
     
-    # TODO: getnameinfo?
+    def getnameinfo(self, address, callback, flags=NI_LOOKUPHOST):
+        """Reverse lookup, calling back with (status, timeouts, node, service)
+        
+        The address is a tuple (host, port), or (host, port, flowinfo,
+        scope_id) for IPv6, as for "socket.getnameinfo". The flags should
+        include NI_LOOKUPHOST and/or NI_LOOKUPSERVICE; the node or service
+        not looked up is None."""
+        
+        sockaddr = pack_sockaddr(address)
+        arg = self.nameinfo_callback.arm(callback)
+        lib.ares_getnameinfo(self.channel, sockaddr, c_int(len(sockaddr)),
+            c_int(flags), self.nameinfo_callback.cfunc, arg)
+    
+    def query(self, name, type, callback, dnsclass=C_IN):
+        """Sends a DNS query, calling back with (status, timeouts, records)
+        
+        For SRV queries, each record is a tuple (priority, weight, port,
+        target). For TXT queries, each record is a byte string. For PTR
+        queries, the records are the host name followed by any aliases.
+        For other types, "records" is the raw response message."""
+        
+        arg = self.query_callback.arm((type, callback))
+        lib.ares_query(self.channel, c_char_p(name.encode()),
+            c_int(dnsclass), c_int(type), self.query_callback.cfunc, arg)
+    
+    def search(self, name, type, callback, dnsclass=C_IN):
+        """Like query(), but appends the search domains like getaddrinfo"""
+        arg = self.query_callback.arm((type, callback))
+        lib.ares_search(self.channel, c_char_p(name.encode()),
+            c_int(dnsclass), c_int(type), self.query_callback.cfunc, arg)
     
     def timeout(self):
         """
@@ -147,41 +382,297 @@ class Options(Structure):
         ("nsort", c_int,),
     )
 
-class HostCallback:
-    def arm(self, refs, callback):
-        self.callback = callback
-        refs.add(self)
-        self.refs = weakref.ref(refs)
-        
-        self.cfunc = CFUNCTYPE(None,
-            c_void_p, c_int, c_int, POINTER(HostEntC))(self.proxy)
-        return self.cfunc
-        
-    @weakmethod
+class Trampoline:
+    """Passes results from a single C callback to many Python callbacks
+    
+    Each pending callback is identified by the "arg" pointer given to
+    c-ares, so no new C function has to be made for each query."""
+    
+    def __init__(self):
+        self.callbacks = dict()  # {arg: callback}
+        self.args = count(1)
+        self.cfunc = self.ctype(self.proxy)
+    
+    def arm(self, callback):
+        """Registers a callback and returns the "arg" value for c-ares"""
+        arg = next(self.args)
+        self.callbacks[arg] = callback
+        return c_void_p(arg)
+
+class HostCallback(Trampoline):
+    ctype = CFUNCTYPE(None, c_void_p, c_int, c_int, POINTER(HostEntC))
+    
     @exc_sink
     def proxy(self, arg, status, timeouts, hostent):
         # Assuming each callback is only ever called once
-        self.refs().remove(self)
+        [form, callback] = self.callbacks.pop(arg)
         
         if status != 0:
             hostent = None
         else:
-            addr_list = []
-            while True:
-                addr = hostent.contents.h_addr_list[len(addr_list)]
-                if not addr:
-                    break
-                addr_list.append(inet_ntop(hostent.contents.h_addrtype,
-                    addr[:hostent.contents.h_length]))
+            hostent = hostent.contents
+            family = hostent.h_addrtype
+            length = hostent.h_length
+            addr_list = packed_addresses(hostent.h_addr_list, length)
+            if form is not None:
+                addr_list = form(family, addr_list)
             hostent = HostEnt(
-                name=hostent.contents.h_name,
-                aliases=NotImplemented,
-                addrtype=hostent.contents.h_addrtype,
-                length=hostent.contents.h_length,
+                name=hostent.h_name,
+                aliases=hostent_aliases(hostent),
+                addrtype=family,
+                length=length,
                 addr_list=addr_list,
             )
         
-        self.callback(status, timeouts, hostent)
+        callback(status, timeouts, hostent)
+
+def packed_addresses(addr_list, length):
+    """Returns byte strings from a null-terminated "h_addr_list" array"""
+    
+    pointers = list()
+    addr_list = cast(addr_list, POINTER(c_void_p))
+    while True:
+        pointer = addr_list[len(pointers)]
+        if pointer is None:
+            break
+        pointers.append(pointer)
+    if not pointers:
+        return pointers
+    
+    # c-ares normally allocates the addresses as one contiguous array, so
+    # copy them all at once when possible
+    start = pointers[0]
+    expected = range(start, start + len(pointers) * length, length)
+    if all(map(int.__eq__, pointers, expected)):
+        data = string_at(start, len(pointers) * length)
+        return [data[i:i + length] for i in range(0, len(data), length)]
+    return [string_at(pointer, length) for pointer in pointers]
+
+def text_addresses(family, addr_list):
+    if family == AF_INET:
+        return list(map(inet_ntoa, addr_list))
+    return [inet_ntop(family, address) for address in addr_list]
+
+def ip_addresses(family, addr_list):
+    return list(map({AF_INET: IPv4Address, AF_INET6: IPv6Address}[family],
+        addr_list))
+
+ADDRESS_FORMS = {"text": text_addresses, "packed": None, "ip": ip_addresses}
+
+class AddrInfoNodeC(Structure):
+    pass
+AddrInfoNodeC._fields_ = (
+    ("ai_ttl", c_int,),
+    ("ai_flags", c_int,),
+    ("ai_family", c_int,),
+    ("ai_socktype", c_int,),
+    ("ai_protocol", c_int,),
+    ("ai_addrlen", c_uint,),
+    ("ai_addr", c_void_p,),
+    ("ai_next", POINTER(AddrInfoNodeC),),
+)
+
+class AddrInfoC(Structure):
+    _fields_ = (
+        ("cnames", c_void_p,),
+        ("nodes", POINTER(AddrInfoNodeC),),
+        ("name", c_char_p,),
+    )
+
+class AddrInfoHints(Structure):
+    _fields_ = (
+        ("ai_flags", c_int,),
+        ("ai_family", c_int,),
+        ("ai_socktype", c_int,),
+        ("ai_protocol", c_int,),
+    )
+
+# Offset and size of the address in "struct sockaddr_in" and "sockaddr_in6"
+SOCKADDR_ADDRESS = {AF_INET: (4, 4), AF_INET6: (8, 16)}
+
+class AddrInfoCallback(Trampoline):
+    ctype = CFUNCTYPE(None, c_void_p, c_int, c_int, POINTER(AddrInfoC))
+    
+    @exc_sink
+    def proxy(self, arg, status, timeouts, result):
+        # Assuming each callback is only ever called once
+        callback = self.callbacks.pop(arg)
+        
+        nodes = list()
+        if result:
+            try:
+                node = result.contents.nodes
+                while node:
+                    node = node.contents
+                    [offset, size] = SOCKADDR_ADDRESS[node.ai_family]
+                    address = string_at(node.ai_addr + offset, size)
+                    nodes.append((node.ai_family,
+                        inet_ntop(node.ai_family, address), node.ai_ttl))
+                    node = node.ai_next
+            finally:
+                lib.ares_freeaddrinfo(result)
+        
+        callback(status, timeouts, nodes)
+
+def hostent_aliases(hostent):
+    aliases = list()
+    if not hostent.h_aliases:
+        return aliases
+    while True:
+        alias = hostent.h_aliases[len(aliases)]
+        if alias is None:
+            return aliases
+        aliases.append(alias)
+
+class NameInfoCallback(Trampoline):
+    ctype = CFUNCTYPE(None, c_void_p, c_int, c_int, c_char_p, c_char_p)
+    
+    @exc_sink
+    def proxy(self, arg, status, timeouts, node, service):
+        callback = self.callbacks.pop(arg)
+        if node is not None:
+            node = node.decode("ascii")
+        if service is not None:
+            service = service.decode("ascii")
+        callback(status, timeouts, node, service)
+
+def pack_sockaddr(address):
+    """Builds "struct sockaddr_in" or "sockaddr_in6" from an address tuple"""
+    host = address[0]
+    if ":" in host:
+        [flowinfo, scope_id] = (tuple(address[2:]) + (0, 0))[:2]
+        return (struct.pack("=H", AF_INET6) +
+            struct.pack("!HI", address[1], flowinfo) +
+            inet_pton(AF_INET6, host) + struct.pack("=I", scope_id))
+    else:
+        return (struct.pack("=H", AF_INET) + struct.pack("!H", address[1]) +
+            inet_pton(AF_INET, host) + bytes(8))
+
+class SrvReplyC(Structure):
+    pass
+SrvReplyC._fields_ = (
+    ("next", POINTER(SrvReplyC),),
+    ("host", c_char_p,),
+    ("priority", c_ushort,),
+    ("weight", c_ushort,),
+    ("port", c_ushort,),
+)
+
+class TxtReplyC(Structure):
+    pass
+TxtReplyC._fields_ = (
+    ("next", POINTER(TxtReplyC),),
+    ("txt", c_void_p,),
+    ("length", c_size_t,),
+)
+
+def parse_srv(abuf, alen):
+    reply = POINTER(SrvReplyC)()
+    check(lib.ares_parse_srv_reply(abuf, alen, byref(reply)))
+    records = list()
+    try:
+        node = reply
+        while node:
+            node = node.contents
+            records.append((node.priority, node.weight, node.port,
+                node.host.decode("ascii")))
+            node = node.next
+    finally:
+        lib.ares_free_data(reply)
+    return records
+
+def parse_txt(abuf, alen):
+    reply = POINTER(TxtReplyC)()
+    check(lib.ares_parse_txt_reply(abuf, alen, byref(reply)))
+    records = list()
+    try:
+        node = reply
+        while node:
+            node = node.contents
+            records.append(string_at(node.txt, node.length))
+            node = node.next
+    finally:
+        lib.ares_free_data(reply)
+    return records
+
+def parse_ptr(abuf, alen):
+    hostent = POINTER(HostEntC)()
+    check(lib.ares_parse_ptr_reply(abuf, alen, None, 0, AF_INET,
+        byref(hostent)))
+    try:
+        names = [hostent.contents.h_name]
+        names.extend(hostent_aliases(hostent.contents))
+    finally:
+        lib.ares_free_hostent(hostent)
+    return [name.decode("ascii") for name in names]
+
+class QueryCallback(Trampoline):
+    ctype = CFUNCTYPE(None, c_void_p, c_int, c_int, c_void_p, c_int)
+    parsers = {T_SRV: parse_srv, T_TXT: parse_txt, T_PTR: parse_ptr}
+    
+    @exc_sink
+    def proxy(self, arg, status, timeouts, abuf, alen):
+        [type, callback] = self.callbacks.pop(arg)
+        records = None
+        if status == SUCCESS:
+            parser = self.parsers.get(type)
+            if parser is None:
+                records = string_at(abuf, alen)
+            else:
+                try:
+                    records = parser(c_void_p(abuf), c_int(alen))
+                except EnvironmentError as e:
+                    status = e.errno
+        callback(status, timeouts, records)
+
+class AddrInfoBatch:
+    """State of a "Channel.getaddrinfo_many" call"""
+    
+    def __init__(self, channel, queries, family, callback, limit, finished):
+        self.channel = channel
+        self.queries = queries
+        self.family = family
+        self.callback = callback
+        self.limit = limit
+        self.finished = finished
+        self.active = 0
+        self.exhausted = False
+        self.starting = False
+    
+    def start(self):
+        # c-ares may call back before returning, for instance for numeric
+        # addresses, so loop here rather than recursing from complete()
+        if self.starting:
+            return
+        self.starting = True
+        try:
+            while not self.exhausted and self.active < self.limit:
+                try:
+                    query = next(self.queries)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+                if isinstance(query, str):
+                    [name, family] = (query, self.family)
+                else:
+                    [name, family] = query
+                self.active += 1
+                self.channel.getaddrinfo(name, family,
+                    partial(self.complete, query))
+        finally:
+            self.starting = False
+        if self.exhausted and not self.active and self.finished is not None:
+            [finished, self.finished] = (self.finished, None)
+            finished()
+    
+    def complete(self, query, status, timeouts, nodes):
+        self.active -= 1
+        if status in {EDESTRUCTION, ECANCELLED}:
+            self.exhausted = True  # Do not start queries on a dead channel
+        try:
+            self.callback(query, status, timeouts, nodes)
+        finally:
+            self.start()
 
 library_init()
 atexit.register(library_cleanup)
@@ -1,8 +1,11 @@
 """Framework for driving async coroutine tasks"""
 
+from socket import socketpair
+import threading
 import weakref
 from functions import weakmethod
 from collections import deque
+from heapq import heappush, heappop, heapify
 from functions import WrapperFunction
 from contextlib import contextmanager
 from traceback import extract_stack
@@ -10,28 +13,149 @@ from warnings import warn
 from .results import ReturnResult, RaiseResult, call_result
 import asyncio
 from asyncio.base_events import BaseEventLoop
-from functools import partial
 
 class EventLoop(BaseEventLoop):
+    """Base for event loops driven by another framework's main loop
+    
+    Subclasses implement new_callbacks() to arrange for invoke_callbacks()
+    to be called soon from the main loop, and add_reader(), which by default
+    is used to wake the loop up from call_soon_threadsafe(). The first
+    call_soon_threadsafe() call creates a socket pair for this and passes
+    it to _watch_wakeup(), possibly from another thread. They also implement
+    set_timer(when) to arrange for expire_timers() to be called at a time
+    given by time(), replacing any previous set_timer() call. Only the
+    earliest of all call_later() and call_at() timers is set this way."""
+    
+    budget = 1000  # Maximum callbacks run by each invoke_callbacks() call
+    
     def __init__(self, *pos, **kw):
         super().__init__(*pos, **kw)
-        self.callbacks = dict()  # {None: [callbacks]}
-    
-    def call_soon(self, callback, *pos, **kw):
+        self._callbacks = deque()  # Ready asyncio.Handle objects
+        self._invoke_pending = False
+        self._threadsafe = deque()  # Handles from call_soon_threadsafe()
+        self._wakeup = None  # Socket pair, once call_soon_threadsafe() used
+        self._wakeup_lock = threading.Lock()
+        self._timers = list()  # Heap of asyncio.TimerHandle objects
+        self._timers_cancelled = 0  # Cancelled handles still in the heap
+    
+    def call_soon(self, callback, *args, context=None):
         # Cannot call back immediately because some call sites assume the
         # callback is not yet invoked when this function returns
-        new = list()
-        queue = self.callbacks.setdefault(None, new)
-        queue.append(partial(callback, *pos, **kw))
-        if queue is new:
+        handle = asyncio.Handle(callback, args, self, context)
+        self._callbacks.append(handle)
+        if not self._invoke_pending:
+            self._invoke_pending = True
+            self.new_callbacks()
+        return handle
+    
+    def call_soon_threadsafe(self, callback, *args, context=None):
+        self._check_closed()
+        handle = asyncio.Handle(callback, args, self, context)
+        self._threadsafe.append(handle)
+        if self._wakeup is None:
+            self._create_wakeup()
+        try:
+            self._wakeup[1].send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # Already full of wakeups
+        return handle
+    
+    def _create_wakeup(self):
+        with self._wakeup_lock:
+            if self._wakeup is None:
+                wakeup = socketpair()
+                for sock in wakeup:
+                    sock.setblocking(False)
+                self._watch_wakeup(wakeup[0].fileno())
+                self._wakeup = wakeup
+    
+    def _watch_wakeup(self, fd):
+        self.add_reader(fd, self._read_wakeup)
+    
+    def _unwatch_wakeup(self, fd):
+        self.remove_reader(fd)
+    
+    def _read_wakeup(self):
+        try:
+            while self._wakeup[0].recv(0x1000):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._threadsafe:
+            self._callbacks.append(self._threadsafe.popleft())
+        if self._callbacks and not self._invoke_pending:
+            self._invoke_pending = True
+            self.new_callbacks()
+    
+    def call_at(self, when, callback, *args, context=None):
+        timer = asyncio.TimerHandle(when, callback, args, self, context)
+        timer._scheduled = True
+        heappush(self._timers, timer)
+        if self._timers[0] is timer:
+            self.set_timer(when)
+        return timer
+    
+    def _timer_handle_cancelled(self, timer):
+        if timer._scheduled:
+            self._timers_cancelled += 1
+    
+    def expire_timers(self):
+        """Queues the callbacks of timers that are due and sets the next"""
+        
+        timers = self._timers
+        if (self._timers_cancelled > 100 and
+                self._timers_cancelled > len(timers) // 2):
+            live = list()
+            for timer in timers:
+                if timer._cancelled:
+                    timer._scheduled = False
+                else:
+                    live.append(timer)
+            heapify(live)
+            self._timers = timers = live
+            self._timers_cancelled = 0
+        
+        end = self.time() + self._clock_resolution
+        while timers and (timers[0]._cancelled or timers[0].when() <= end):
+            timer = heappop(timers)
+            timer._scheduled = False
+            if timer._cancelled:
+                self._timers_cancelled -= 1
+            else:
+                self._callbacks.append(timer)
+        if timers:
+            self.set_timer(timers[0].when())
+        if self._callbacks and not self._invoke_pending:
+            self._invoke_pending = True
             self.new_callbacks()
-    def call_soon_threadsafe(self, *pos, **kw):
-        return self.call_soon(*pos, **kw)
     
     def invoke_callbacks(self):
-        callbacks = self.callbacks.pop(None)
-        for callback in callbacks:
-            callback()
+        """Runs callbacks that were ready when called, up to "budget"
+        
+        Callbacks queued in the meantime, or beyond the budget, are left
+        for another call, so that the main loop can service other events.
+        Exceptions are passed to the exception handler by asyncio.Handle
+        without affecting the remaining callbacks."""
+        
+        self._invoke_pending = False
+        callbacks = self._callbacks
+        for _ in range(min(len(callbacks), self.budget)):
+            handle = callbacks.popleft()
+            if not handle._cancelled:
+                handle._run()
+        if callbacks and not self._invoke_pending:
+            self._invoke_pending = True
+            self.new_callbacks()
+    
+    def close(self):
+        if self._wakeup is not None:
+            self._unwatch_wakeup(self._wakeup[0].fileno())
+            for sock in self._wakeup:
+                sock.close()
+            self._wakeup = None
+        self._callbacks.clear()
+        self._timers.clear()
+        super().close()
     
     def run_until_complete(self, future):
         future = asyncio.ensure_future(future, loop=self)
@@ -56,6 +180,9 @@ class Thread(object):
     parent coroutine is continued
     """
     
+    __slots__ = (
+        "result", "reapers", "routines", "event", "_resume", "__weakref__")
+    
     def __init__(self, routine, join=False):
         """
         join=True argument indicates that any exception raised or value
@@ -67,33 +194,58 @@ class Thread(object):
         self.result = join
         self.reapers = list()
         self.routines = [routine]
+        self.event = None
+        self._resume = self.resume  # Weak binding reused for every event
         with firedoor(self):
-            self.trampoline(_startresult)
+            self.trampoline(None, None)
     
     @weakmethod
-    def resume(self, result=ReturnResult()):
+    def resume(self, result=None):
         self.event.close()
-        self.trampoline(result)
+        if result is None:
+            self.trampoline(None, None)
+        elif isinstance(result, RaiseResult):
+            self.trampoline(None, result.exception())
+        else:
+            self.trampoline(result.result(), None)
     
-    def trampoline(self, result):
-        while self.routines:
-            call = result.resume_call(self.routines[-1])
-            result = Result.from_call(call)
-            
-            if isinstance(result, RaiseResult):
-                self.routines.pop()
-                if isinstance(result.exception(), StopIteration):
-                    result = ReturnResult(*result.exception().args)
-            
-            elif isinstance(result, ReturnResult):
-                if isinstance(result.result(), Event):
-                    self.event = result.result()
-                    self.event.block(self.resume)
-                    return
+    def trampoline(self, value, exc):
+        """Runs the generators until an event is yielded
+        
+        The innermost generator is resumed with "value", or with "exc"
+        raised if it is not None. Result objects are only made once the
+        outermost generator finishes."""
+        
+        routines = self.routines
+        while routines:
+            routine = routines[-1]
+            try:
+                if exc is None:
+                    value = routine.send(value)
                 else:
-                    self.routines.append(result.result())
-                    result = _startresult
+                    value = routine.throw(exc)
+                    exc = None
+            except StopIteration as stop:
+                routines.pop()
+                [value, exc] = (stop.value, None)
+                continue
+            except BaseException as error:
+                routines.pop()
+                [value, exc] = (None, error)
+                continue
+            
+            if isinstance(value, Event):
+                self.event = value
+                value.block(self._resume)
+                return
+            routines.append(value)
+            value = None
         
+        if exc is None:
+            result = ReturnResult(value)
+        else:
+            result = RaiseResult(exc)
+            exc = None  # Traceback references this frame
         if self.result:
             self.result = result
         else:
@@ -120,7 +272,7 @@ class Thread(object):
             yield r
         
         if self.result:
-            raise self.result.exit_generator()
+            return self.result.result()
     
     def __repr__(self):
         return "<{0} {1:#x}>".format(type(self).__name__, id(self))
@@ -136,9 +288,6 @@ class Thread(object):
                 break
         return stack
 
-# Imitation Result object to start a generator by invoking send(None)
-_startresult = ReturnResult(None)
-
 class MainTask(asyncio.Task):
     """Task that is not expected to return a value or exception"""
     
@@ -161,6 +310,8 @@ class Event:
     The default implementation has a "callback" attribute which can be called
     to resume the thread. It is set to None when the event is not active."""
     
+    __slots__ = ("callback",)
+    
     def __init__(self):
         self.callback = None
     
@@ -196,6 +347,7 @@ class AsyncioGenerator:
 class Callback(Event):
     """A simple event triggered by calling it
     """
+    __slots__ = ()
     def __call__(self, *args):
         """
         Positional arguments passed to the callback are yielded from the
@@ -206,6 +358,7 @@ class Callback(Event):
 class Queue(Event):
     """An event that may be triggered before it is armed (message queue)
     """
+    __slots__ = ("queue",)
     def __init__(self):
         Event.__init__(self)
         self.queue = deque()
@@ -238,6 +391,48 @@ class Queue(Event):
         """Return the number of messages waiting in the queue"""
         return len(self.queue)
 
+class Offload(Event):
+    """Runs a function in a "concurrent.futures" executor
+    
+    A thread yielding this event is resumed with the function's return
+    value, or has its exception raised, once the function finishes. The
+    event may also be awaited from an asyncio task. The result is passed
+    back to the event loop with call_soon_threadsafe(). For a
+    ThreadPoolExecutor, the exception keeps its original traceback; for a
+    ProcessPoolExecutor, the remote traceback is attached as the
+    exception's __cause__."""
+    
+    __slots__ = ("loop", "future")
+    
+    def __init__(self, loop, executor, func, *args, **kw):
+        Event.__init__(self)
+        self.loop = loop
+        self.future = executor.submit(func, *args, **kw)
+    
+    def block(self, callback):
+        Event.block(self, callback)
+        # Called straight away if already done
+        self.future.add_done_callback(self._done)
+    
+    def _done(self, future):
+        self.loop.call_soon_threadsafe(self._deliver)
+    
+    def _deliver(self):
+        if self.callback is None:
+            return  # Thread closed while waiting
+        if self.future.cancelled():
+            result = RaiseResult(asyncio.CancelledError())
+        else:
+            exc = self.future.exception()
+            if exc is None:
+                result = ReturnResult(self.future.result())
+            else:
+                result = RaiseResult(exc)
+        self.callback(result)
+    
+    def __await__(self):
+        return asyncio.wrap_future(self.future, loop=self.loop).__await__()
+
 class Select(Event):
     """An event triggered by any of a set of alternatives"""
     
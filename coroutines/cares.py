@@ -1,14 +1,35 @@
 import cares
 from socket import (AF_UNSPEC, AF_INET, AF_INET6)
 from sys import stderr
-from asyncio import Future
+from time import time
+from asyncio import (
+    Future, shield, ensure_future, wait, sleep, FIRST_COMPLETED)
+from functools import partial
+from collections import OrderedDict, deque
+import weakref
 from net import format_addr
 
+# RFC 8305 recommended values
+CONNECTION_ATTEMPT_DELAY = 0.25
+RESOLUTION_DELAY = 0.05
+
 async def name_connect(event_driver, address, Socket, *,
-        callback=None, message=None):
+        callback=None, message=None, happy_eyeballs=False,
+        delay=CONNECTION_ATTEMPT_DELAY):
+    """Resolves a host name and connects a new socket
+    
+    "Socket" is called with an address family to create the socket. With
+    happy_eyeballs=True, IPv6 and IPv4 addresses are resolved concurrently
+    and connection attempts are started "delay" seconds apart, alternating
+    between address families, as in RFC 8305. The first attempt to
+    connect is returned, and the others are cancelled."""
+    
     hostname = address[0]
     if message is not None:
         callback = MessageCallback(message)
+    if happy_eyeballs:
+        return await _happy_connect(event_driver, address, Socket,
+            callback, delay)
     
     resolved = False
     
@@ -49,6 +70,103 @@ async def name_connect(event_driver, address, Socket, *,
         else:
             raise EnvironmentError("Failure resolving {}".format(hostname))
 
+async def _happy_connect(loop, address, Socket, callback, delay):
+    hostname = address[0]
+    lookups = dict()  # {Future: family}
+    for family in (AF_INET6, AF_INET):
+        if callback is not None:
+            callback.lookingup(hostname, family)
+        lookup = ensure_future(resolve(loop, hostname, family), loop=loop)
+        lookups[lookup] = family
+    queues = {AF_INET6: deque(), AF_INET: deque()}
+    family = AF_INET6  # Family of the next attempt
+    attempts = set()
+    resolved = False
+    next_attempt = None  # Loop time to start the next attempt
+    started = False
+    try:
+        while lookups or attempts or any(queues.values()):
+            if (any(queues.values()) and next_attempt is not None and
+                    loop.time() >= next_attempt):
+                if not queues[family]:
+                    family = OTHER_FAMILY[family]
+                attempt = queues[family].popleft()
+                attempts.add(ensure_future(
+                    _attempt(loop, Socket, family, attempt, callback),
+                    loop=loop))
+                family = OTHER_FAMILY[family]
+                started = True
+                next_attempt = loop.time() + delay
+            
+            timeout = None
+            if any(queues.values()):
+                timeout = max(next_attempt - loop.time(), 0)
+            if not lookups and not attempts:
+                await sleep(timeout)
+                continue
+            [done, _] = await wait(set(lookups) | attempts,
+                timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                if future in attempts:
+                    attempts.remove(future)
+                    try:
+                        return future.result()
+                    except EnvironmentError as e:
+                        print(e, file=stderr)
+                    # Start the next attempt without waiting for the delay
+                    next_attempt = loop.time()
+                    continue
+                
+                lookup_family = lookups.pop(future)
+                try:
+                    hostent = future.result()
+                except EnvironmentError as e:
+                    print(e, file=stderr)
+                else:
+                    resolved = True
+                    queues[lookup_family].extend((attempt,) + address[1:]
+                        for attempt in hostent.addr_list)
+                if not started:
+                    if AF_INET6 in lookups.values():
+                        # Give the IPv6 lookup a chance to finish first
+                        next_attempt = loop.time() + RESOLUTION_DELAY
+                    else:
+                        next_attempt = loop.time()
+    finally:
+        for future in set(lookups) | attempts:
+            if not future.done():
+                future.cancel()  # Attempt closes its socket
+            elif not future.cancelled() and future.exception() is None:
+                if future in attempts:
+                    future.result().close()  # Lost the race
+    
+    if resolved:
+        raise EnvironmentError("All addresses unconnectable: {}".format(
+            hostname))
+    else:
+        raise EnvironmentError("Failure resolving {}".format(hostname))
+
+OTHER_FAMILY = {AF_INET6: AF_INET, AF_INET: AF_INET6}
+
+async def _attempt(loop, Socket, family, address, callback):
+    # Older callbacks only implement connecting()
+    attempted = getattr(callback, "attempted", None)
+    if callback is not None:
+        callback.connecting(address)
+    start = loop.time()
+    sock = Socket(family)
+    try:
+        await sock.connect(address)
+    except BaseException as e:
+        sock.close()
+        if attempted is not None and isinstance(e, EnvironmentError):
+            attempted(address, loop.time() - start, e)
+        raise
+    if attempted is not None:
+        attempted(address, loop.time() - start)
+    return sock
+
 class MessageCallback:
     def __init__(self, callback):
         self.callback = callback
@@ -56,59 +174,318 @@ class MessageCallback:
         self.callback("Looking up {} (family {})".format(name, family))
     def connecting(self, address):
         self.callback("Connecting to " + format_addr(address))
+    def attempted(self, address, elapsed, error=None):
+        """Reports the time taken by a connection attempt"""
+        if error is None:
+            msg = "Connected to {} in {:.0f} ms"
+        else:
+            msg = "Connection to {} failed after {:.0f} ms: {}"
+        self.callback(msg.format(format_addr(address), elapsed * 1000, error))
 
 async def resolve(event_driver, name, family=AF_UNSPEC):
-    self = ResolveContext(loop=event_driver)
-    channel = cares.Channel(sock_state_cb=self.sock_state)
-    channel.gethostbyname(name, family, self.host)
-    while self.status is None:
-        timeout = channel.timeout()
-        if timeout is not None:
-            timeout_result = (None, None)
-            timeout = event_driver.call_later(timeout,
-                self.sock_future.set_result, timeout_result)
-        result = await self.sock_future
-        if timeout is not None and result is not timeout_result:
-            timeout.cancel()
-        self.sock_future = Future(loop=event_driver)
-        [read, write] = result
-        if read is not None:
-            self.loop.add_reader(read, self.sock_future.set_result, result)
-        if write is not None:
-            self.loop.add_writer(write, self.sock_future.set_result, result)
-        channel.process_fd(read, write)
-    cares.check(self.status)
-    return self.hostent
+    """Looks up a name using the shared resolver for the event loop"""
+    return await Resolver.for_loop(event_driver).resolve(name, family)
 
-class ResolveContext:
-    def __init__(self, *, loop):
+class Resolver:
+    """Shares one c-ares channel between lookups on an event loop
+    
+    Answers are cached for their DNS time to live, limited to "max_ttl"
+    seconds. Names that do not exist, or have no addresses, are cached for
+    "negative_ttl" seconds. At most "max_size" answers are kept; the least
+    recently used are discarded first. Concurrent lookups of the same name
+    share one query. Answers already in "cares.snapshot", such as those
+    loaded by "cares.library_init", are used until they expire, and new
+    answers are recorded there when a snapshot file is in use.
+    """
+    
+    _loops = weakref.WeakKeyDictionary()  # {loop: Resolver}
+    
+    @classmethod
+    def for_loop(cls, loop):
+        try:
+            return cls._loops[loop]
+        except LookupError:
+            resolver = cls(loop=loop)
+            cls._loops[loop] = resolver
+            return resolver
+    
+    def __init__(self, *, loop, max_size=1000, max_ttl=3600, negative_ttl=30,
+            servers=None):
         self.loop = loop
-        self.sock_future = Future(loop=self.loop)
-        self.status = None
-        self.reading = set()
-        self.writing = set()
-    
-    def sock_state(self, s, read, write):
-        if read:
-            if s not in self.reading:
-                result = (s, None)
-                self.loop.add_reader(s, self.sock_future.set_result, result)
-                self.reading.add(s)
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.channel = cares.Channel(sock_state_cb=self._sock_state)
+        if servers is not None:
+            self.channel.set_servers(servers)
+        self._cache = OrderedDict()  # {(name, family): (expiry, result)}
+        now = time()
+        for [key, [expiry, hostent]] in list(cares.snapshot.items()):
+            if expiry > now:
+                expiry = self.loop.time() + expiry - now
+                self._cache[key] = (expiry, hostent)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        self._pending = dict()  # {(name, family): Future}
+        self._interest = dict()  # {socket: (read, write)}
+        self._ready_read = set()
+        self._ready_write = set()
+        self._flush_handle = None
+        self._timer = None
+    
+    async def resolve(self, name, family=AF_UNSPEC):
+        """Returns a "cares.HostEnt" or raises EnvironmentError"""
+        
+        key = (name, family)
+        try:
+            [expiry, result] = self._cache[key]
+        except LookupError:
+            pass
         else:
-            if s in self.reading:
-                self.loop.remove_reader(s)
-                self.reading.remove(s)
+            if expiry > self.loop.time():
+                self._cache.move_to_end(key)
+                return self._result(result)
+            del self._cache[key]
+        
+        future = self._pending.get(key)
+        if future is None:
+            future = Future(loop=self.loop)
+            self._pending[key] = future
+            callback = partial(self._answer, key)
+            self.channel.getaddrinfo(name, family, callback)
+            self._schedule()
+        # Shield the shared query from cancellation of one caller
+        return self._result(await shield(future))
+    
+    async def resolve_many(self, names, family=AF_UNSPEC, *, limit=100):
+        """Looks up many names, yielding (name, result) as each completes
+        
+        Each name may also be a tuple (name, family). The result is a
+        "cares.HostEnt", or an EnvironmentError instance. A result is
+        yielded for each name given, including repeated names. At most
+        "limit" queries are in flight at once. Answers are cached as for
+        resolve(), and cached answers are yielded first. Names already
+        being looked up, for instance by resolve(), share that query."""
+        
+        now = self.loop.time()
+        uncached = dict()  # {(name, family): [query, . . .]}
+        for query in names:
+            if isinstance(query, str):
+                key = (query, family)
+            else:
+                key = tuple(query)
+            try:
+                [expiry, result] = self._cache[key]
+            except LookupError:
+                uncached.setdefault(key, list()).append(query)
+                continue
+            if expiry <= now:
+                del self._cache[key]
+                uncached.setdefault(key, list()).append(query)
+                continue
+            self._cache.move_to_end(key)
+            yield (query, self._error(result))
+        
+        ready = deque()
+        wakeup = None
+        def complete(key, future):
+            ready.append((key, future.result()))
+            if wakeup is not None and not wakeup.done():
+                wakeup.set_result(None)
+        new = dict()  # {(name, family): Future}
+        for key in uncached:
+            future = self._pending.get(key)
+            if future is None:
+                future = Future(loop=self.loop)
+                self._pending[key] = future
+                new[key] = future
+            future.add_done_callback(partial(complete, key))
+        def finish():
+            # Queries not started because the channel was destroyed
+            for [key, future] in new.items():
+                if not future.done():
+                    del self._pending[key]
+                    future.set_result(cares.ECANCELLED)
+        self.channel.getaddrinfo_many(new, self._answer,
+            limit=limit, finished=finish)
+        self._schedule()
+        remaining = len(uncached)
+        while remaining:
+            while ready:
+                [key, result] = ready.popleft()
+                remaining -= 1
+                for query in uncached[key]:
+                    yield (query, self._error(result))
+            if remaining:
+                wakeup = Future(loop=self.loop)
+                await wakeup
+    
+    async def query(self, name, type, *, search=False):
+        """Returns records as parsed by "cares.Channel.query"
         
-        if write:
-            if s not in self.writing:
-                result = (None, s)
-                self.loop.add_writer(s, self.sock_future.set_result, result)
-                self.writing.add(s)
+        With search=True, the search domains are tried as well. Raises
+        EnvironmentError on failure. Answers are not cached."""
+        
+        future = Future(loop=self.loop)
+        callback = partial(self._complete, future)
+        if search:
+            self.channel.search(name, type, callback)
+        else:
+            self.channel.query(name, type, callback)
+        return await self._wait(future)
+    
+    async def getnameinfo(self, address, flags=cares.NI_LOOKUPHOST):
+        """Returns (node, service) for an address tuple"""
+        future = Future(loop=self.loop)
+        self.channel.getnameinfo(address, partial(self._complete, future),
+            flags)
+        return await self._wait(future)
+    
+    async def _wait(self, future):
+        self._schedule()
+        return await future
+    
+    def _complete(self, future, status, timeouts, *result):
+        if future.done():  # Cancelled
+            return
+        if status == cares.SUCCESS:
+            if len(result) == 1:
+                [result] = result
+            future.set_result(result)
+        else:
+            future.set_exception(
+                EnvironmentError(status, cares.strerror(status)))
+    
+    def _error(self, result):
+        if isinstance(result, int):
+            return EnvironmentError(result, cares.strerror(result))
+        return result
+    
+    def _result(self, result):
+        if isinstance(result, int):
+            cares.check(result)
+        return result
+    
+    def _answer(self, key, status, timeouts, nodes):
+        result = self._store(key, status, nodes)
+        future = self._pending.pop(key)
+        if not future.done():
+            future.set_result(result)
+    
+    def _store(self, key, status, nodes):
+        """Caches and returns a HostEnt or status code"""
+        [name, family] = key
+        if status == cares.SUCCESS and not nodes:
+            status = cares.ENODATA
+        if status == cares.SUCCESS:
+            # Only use the first family, as gethostbyname() would
+            addrtype = nodes[0][0]
+            nodes = [node for node in nodes if node[0] == addrtype]
+            result = cares.HostEnt(
+                name=name.encode(),
+                aliases=[],
+                addrtype=addrtype,
+                length=cares.SOCKADDR_ADDRESS[addrtype][1],
+                addr_list=[address for [_, address, _] in nodes],
+            )
+            ttl = min(min(ttl for [_, _, ttl] in nodes), self.max_ttl)
+            cares.record_snapshot(key, time() + ttl, result)
         else:
-            if s in self.writing:
+            result = status
+            if status in {cares.ENOTFOUND, cares.ENODATA}:
+                ttl = self.negative_ttl
+            else:
+                ttl = 0  # Do not cache temporary failures
+        
+        if ttl > 0:
+            self._cache[key] = (self.loop.time() + ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return result
+    
+    def _sock_state(self, s, read, write):
+        [reading, writing] = self._interest.get(s, (False, False))
+        if read != reading:
+            if read:
+                self.loop.add_reader(s, self._readable, s)
+            else:
+                self.loop.remove_reader(s)
+        if write != writing:
+            if write:
+                self.loop.add_writer(s, self._writable, s)
+            else:
                 self.loop.remove_writer(s)
-                self.writing.remove(s)
+        if read or write:
+            self._interest[s] = (read, write)
+        else:
+            self._interest.pop(s, None)
+    
+    # Ready sockets are collected and serviced together by _flush(), so
+    # that the timer is only reconsidered once per batch
+    
+    def _readable(self, s):
+        self._ready_read.add(s)
+        self._flush_soon()
+    
+    def _writable(self, s):
+        self._ready_write.add(s)
+        self._flush_soon()
     
-    def host(self, status, timeouts, hostent):
-        self.status = status
-        self.hostent = hostent
+    def _flush_soon(self):
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_soon(self._flush)
+    
+    def _flush(self):
+        self._flush_handle = None
+        reads = self._ready_read
+        writes = self._ready_write
+        self._ready_read = set()
+        self._ready_write = set()
+        for s in reads:
+            self.channel.process_fd(s, s if s in writes else None)
+        for s in writes - reads:
+            self.channel.process_fd(None, s)
+        self._schedule()
+    
+    def _schedule(self):
+        """Ensures the timer fires no later than c-ares needs
+        
+        A timer that is already due first is left alone; it will
+        reschedule itself if it fires early."""
+        
+        timeout = self.channel.timeout()
+        if timeout is None:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return
+        deadline = self.loop.time() + timeout
+        if self._timer is not None:
+            if self._timer.when() <= deadline:
+                return
+            self._timer.cancel()
+        self._timer = self.loop.call_at(deadline, self._expire)
+    
+    def _expire(self):
+        self._timer = None
+        self.channel.process_fd(None, None)
+        self._schedule()
+    
+    def close(self):
+        for [s, [read, write]] in self._interest.items():
+            if read:
+                self.loop.remove_reader(s)
+            if write:
+                self.loop.remove_writer(s)
+        self._interest.clear()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._loops.get(self.loop) is self:
+            del self._loops[self.loop]
+        # Pending queries can keep the channel alive through reference
+        # cycles, so do not rely on garbage collection
+        self.channel.destroy()
+        self.channel = None
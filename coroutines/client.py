@@ -0,0 +1,193 @@
+"""Keep-alive HTTP client reusing "coroutines.http" connections"""
+
+from collections import deque
+from functools import partial
+from asyncio import Future
+from select import select
+import ssl
+import http.client
+import net
+from .http import HTTPConnection, decode_response
+from .socket import Socket, Ssl
+from .cares import name_connect
+
+class ConnectionPool:
+    """Holds connections for an event loop, keyed by (scheme, host, port)
+    
+    At most "limit_per_host" connections for each key are in use at once;
+    further acquire() calls wait for a connection to be released. Up to
+    "max_idle_per_host" released connections are kept for reuse.
+    """
+    
+    ports = {"http": 80, "https": 443}
+    
+    def __init__(self, *, loop, limit_per_host=8, max_idle_per_host=4,
+            ssl_context=None):
+        self.loop = loop
+        self.limit_per_host = limit_per_host
+        self.max_idle_per_host = max_idle_per_host
+        self.ssl_context = ssl_context
+        self._idle = dict()  # {key: [HTTPConnection, . . .]}
+        self._active = dict()  # {key: number of acquired connections}
+        self._waiting = dict()  # {key: deque([Future, . . .])}
+    
+    async def acquire(self, key, reuse=True):
+        """Returns (connection, reused)
+        
+        With reuse=False, a new connection is always made."""
+        while self._active.get(key, 0) >= self.limit_per_host:
+            waiter = Future(loop=self.loop)
+            waiters = self._waiting.setdefault(key, deque())
+            waiters.append(waiter)
+            try:
+                await waiter
+            except:
+                if not waiter.done():
+                    waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # Cancelled after being woken, so pass the wakeup on
+                    self._wake(key)
+                raise
+        self._active[key] = self._active.get(key, 0) + 1
+        
+        try:
+            idle = self._idle.get(key, ())
+            while reuse and idle:
+                connection = idle.pop()
+                if self._check_reusable(connection):
+                    return (connection, True)
+                connection.sock.close()
+            return (await self._connect(key), False)
+        except:
+            self._end(key)
+            raise
+    
+    def release(self, key, connection, reusable=True):
+        """Returns a connection once its response has been read"""
+        idle = self._idle.setdefault(key, list())
+        if reusable and len(idle) < self.max_idle_per_host:
+            idle.append(connection)
+        else:
+            connection.sock.close()
+        self._end(key)
+    
+    def close(self):
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.sock.close()
+        self._idle.clear()
+    
+    def _end(self, key):
+        self._active[key] -= 1
+        self._wake(key)
+    
+    def _wake(self, key):
+        waiters = self._waiting.get(key, ())
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+    
+    def _check_reusable(self, connection):
+        if connection.reader.buffer:
+            return False  # Unexpected data after the last response
+        # Assume EOF or 408 Request Timeout has been signalled if readable,
+        # as for "net.PersistentConnectionHandler"
+        return not any(select((connection.sock.sock,), (), (), 0))
+    
+    async def _connect(self, key):
+        [scheme, host, port] = key
+        sock = await name_connect(self.loop, (host, port),
+            partial(Socket, loop=self.loop))
+        try:
+            if scheme == "https":
+                context = self.ssl_context
+                if context is None:
+                    context = ssl.create_default_context()
+                sock = Ssl(context, sock, server_hostname=host)
+                await sock.handshake()
+            return HTTPConnection(sock)
+        except:
+            sock.close()
+            raise
+
+class Session:
+    """Makes requests over connections from a "ConnectionPool"
+    
+    session = Session(loop=loop)
+    response = await session.request("GET", "http://localhost/")
+    while True:
+        data = await response.read(0x10000)
+        if not data:
+            break
+    
+    The connection is returned to the pool once the response body has been
+    read, or is closed if the response is closed early.
+    
+    With accept_encoding=True, requests advertise the codings from
+    "net.ACCEPT_ENCODING", and encoded responses are decoded as they are
+    read (see "coroutines.http.DecodedResponse").
+    """
+    
+    idempotents = {"GET", "HEAD", "PUT", "DELETE", "TRACE", "OPTIONS"}
+    
+    def __init__(self, *, loop, pool=None, accept_encoding=False, **kw):
+        if pool is None:
+            pool = ConnectionPool(loop=loop, **kw)
+        self.pool = pool
+        self.accept_encoding = accept_encoding
+    
+    async def request(self, method, url, headers=(), body=None):
+        url = net.url_port(url, "http", self.pool.ports)
+        key = (url["scheme"], url["hostname"], url["port"])
+        port = url["port"]
+        if port == self.pool.ports[url["scheme"]]:
+            port = None
+        host = net.format_addr((url["hostname"], port))  # Brackets IPv6
+        headers = dict(headers)
+        headers.setdefault("Host", host)
+        headers.setdefault("User-Agent", HTTPConnection.AGENT)
+        if self.accept_encoding:
+            headers.setdefault("Accept-Encoding", net.ACCEPT_ENCODING)
+        if body is not None:
+            headers.setdefault("Content-Length", format(len(body)))
+        
+        reuse = True
+        while True:
+            [connection, reused] = await self.pool.acquire(key, reuse)
+            try:
+                await connection.putrequest(method, url["path"] or "/")
+                for item in headers.items():
+                    await connection.putheader(*item)
+                await connection.endheaders(body)
+                response = await connection.getresponse(method)
+            except (ConnectionError, http.client.BadStatusLine):
+                self.pool.release(key, connection, reusable=False)
+                if not reused or method not in self.idempotents:
+                    raise
+                # Other idle connections are probably also stale
+                reuse = False
+                continue  # Retry on a fresh connection
+            except:
+                self.pool.release(key, connection, reusable=False)
+                raise
+            break
+        
+        close = any(token.lower() == "close"
+            for token in net.header_list(response.msg, "Connection"))
+        if method == "HEAD" or response.status in {204, 304}:
+            # No body, and "complete" is already set
+            self.pool.release(key, connection, not close)
+        else:
+            response.complete.add_done_callback(
+                partial(self._complete, key, connection, close))
+            if self.accept_encoding:
+                response = decode_response(response)
+        return response
+    
+    def _complete(self, key, connection, close, complete):
+        self.pool.release(key, connection, complete.result() and not close)
+    
+    def close(self):
+        self.pool.close()
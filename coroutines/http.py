@@ -8,126 +8,77 @@ from http.client import (
     UnknownTransferEncoding, UnknownProtocol, HTTPException)
 import http.client
 import email.parser
+import re
 import net
-from asyncio import Future
+from asyncio import Future, IncompleteReadError
 
 class HTTPConnection:
     def __init__(self, sock):
         self.sock = sock
+        self.reader = Reader(sock)
+        self.buffer = bytearray()
     
     async def putrequest(self, method, target):
-        await self.sock.sendall(method.encode())
-        await self.sock.sendall(b" ")
+        """Starts buffering a request; nothing is sent until endheaders()"""
+        
+        self.buffer.extend(method.encode())
+        self.buffer.extend(b" ")
         if isinstance(target, str):
             target = target.encode("ascii")
-        for c in target:
-            if c <= ord(b" "):
-                await self.sock.sendall("%{:02X}".format(c).encode("ascii"))
-            else:
-                await self.sock.sendall(bytes((c,)))
-        
-        await self.sock.sendall(b" HTTP/1.1\r\n")
+        if len(target.translate(None, CONTROLS)) < len(target):
+            target = CONTROL_PATTERN.sub(escape_control, target)
+        self.buffer.extend(target)
+        self.buffer.extend(b" HTTP/1.1\r\n")
     
     AGENT = "coroutines.http (Vadmium)"
     
-    async def endheaders(self):
-        await self.sock.sendall(b"\r\n")
+    # Bodies up to this size are sent in the same write as the header
+    SMALL_BODY = 0x4000
     
-    async def putheader(self, name, value):
-        await self.sock.sendall(name.encode("ascii"))
-        await self.sock.sendall(b": ")
-        await self.sock.sendall(value.encode("ascii"))
-        await self.sock.sendall(b"\r\n")
-    
-    async def getresponse(self):
-        parser = Parser(self.sock)
-        # else: parser.new_line()
-        await parser.next_char()
+    async def endheaders(self, message_body=None):
+        """Sends the buffered request header in a single write
         
-        #~ try:
-        if True:
-            #~ # if response does not begin "HTTP/n.n 999 ", assume HTTP/0.9
-            #~ # simple-response
-            
-            try:
-                pre_space = await parser.space()
-            except ExcessError as e:
-                raise BadStatusLine(e.data)
-            if parser.c == b"\n":
-                raise BadStatusLine(pre_space + parser.c)
-            
-            pattern = b"HTTP/"
-            for (i, p) in enumerate(pattern):
-                if i:
-                    await parser.next_char()
-                if not parser.c or ord(parser.c) != p:
-                    raise BadStatusLine(pre_space + pattern[:i] + parser.c)
-            
-            major = bytearray()
-            for _ in range(parser.NUMBER_LIMIT):
-                await parser.next_char()
-                if parser.c == b".":
-                    break
-                major.extend(parser.c)
-                if not parser.c.isdigit():
-                    raise BadStatusLine(pre_space + pattern + major)
-            else:
-                raise BadStatusLine(pre_space + pattern + major)
-            
-            minor = bytearray()
-            for _ in range(parser.NUMBER_LIMIT):
-                await parser.next_char()
-                if not parser.c.isdigit():
-                    break
-                minor.extend(parser.c)
-            else:
-                raise BadStatusLine(pre_space + pattern + major + b"." +
-                    minor)
-            
-            mid_space = bytearray()
-            for i in range(parser.TOKEN_LIMIT):
-                if i:
-                    await parser.next_char()
-                if not parser.c or parser.c.isspace():
-                    break
-                mid_space.extend(parser.c)
-            try:
-                space = await parser.space()
-            except ExcessError as e:
-                raise BadStatusLine(pre_space + pattern + major + b"." +
-                    minor + mid_space + e.data)
-            mid_space.extend(space)
-            if parser.c == b"\n":
-                raise BadStatusLine(pre_space + pattern + major + b"." +
-                    minor + mid_space + parser.c)
-            
-            status = bytearray()
-            for i in range(3):
-                if i:
-                    await parser.next_char()
-                status.extend(parser.c)
-                if not parser.c.isdigit():
-                    raise BadStatusLine(pre_space + pattern + major + b"." +
-                        minor + mid_space + status)
+        A small "message_body" is included in the same vectored write.
+        """
         
-        if int(major) != 1:
-            raise UnknownProtocol("HTTP/{}".format(major))
+        self.buffer.extend(b"\r\n")
+        buffers = [self.buffer]
+        if message_body is not None and len(message_body) <= self.SMALL_BODY:
+            buffers.append(message_body)
+            message_body = None
+        try:
+            await self.sock.sendmsg(buffers)
+        finally:
+            self.buffer = bytearray()
+        if message_body is not None:
+            await self.sock.sendall(message_body)
+    
+    async def putheader(self, name, value):
+        self.buffer.extend(name.encode("ascii"))
+        self.buffer.extend(b": ")
+        self.buffer.extend(value.encode("ascii"))
+        self.buffer.extend(b"\r\n")
+    
+    async def getresponse(self, method=None):
+        """Reads the response head
         
-        await parser.next_char()
-        await parser.space()
+        Pass the request "method" so that the response to HEAD is known
+        to have no body."""
         
-        reason = bytearray()
-        for _ in range(400):
-            current = parser.c
-            reason.extend(current)
-            await parser.next_char()
-            if current in b"\n" and not parser.at_lws():  # Including EOF
+        parser = Parser(self.reader)
+        while True:
+            [major, status, reason] = await parser.status_line()
+            if int(major) != 1:
+                raise UnknownProtocol("HTTP/{}".format(
+                    major.decode("ascii")))
+            msg = await parser.headers()
+            # Skip interim responses, e.g. "100 Continue" or "103 Early Hints"
+            if not status.startswith(b"1") or status == b"101":
                 break
-        else:
-            raise ExcessError("Status reason of 400 or more characters")
-        reason = reason.rstrip()
         
-        msg = await parser.headers()
+        if (method == "HEAD" or status == b"101" or
+                status in {b"204", b"304"}):
+            return _LengthResponse(status, reason, msg, self.reader, "0", ())
         
         encodings = net.header_list(msg, "Transfer-Encoding")
         encoding = next(encodings, None)
@@ -135,10 +86,10 @@ class HTTPConnection:
             lengths = net.header_list(msg, "Content-Length")
             length = next(lengths, None)
             if length is None:
-                return _EofResponse(status, reason, msg, self.sock)
+                return _EofResponse(status, reason, msg, self.reader)
             else:
                 return _LengthResponse(status, reason, msg,
-                    self.sock, length, lengths)
+                    self.reader, length, lengths)
         
         # TODO: check for "identity"
         encodings = next(encodings, None)
@@ -146,158 +97,449 @@ class HTTPConnection:
             raise UnknownTransferEncoding("Not chunked transfer encoding")
         del msg["Transfer-Encoding"]
         
-        return _ChunkedResponse(status, reason, msg, self.sock)
+        return _ChunkedResponse(status, reason, msg, self.reader)
 
 class HTTPResponse:
-    def __init__(self, status, reason, msg):
-        self.status = int(status)
-        self.reason = reason.decode("latin-1")
+    """Base class for responses
+    
+    The "complete" future is set once the body has been read, with a result
+    of True if the connection may then be used for another request.
+    
+    The body may be read with read(), readinto() or readexactly(), or by
+    iterating with "async for". No more than "high_water" bytes are
+    returned by each iteration, or held at once by read() calls with no
+    size.
+    
+    A "status" of None is for the body of a request, as read by
+    "coroutines.server"; there is then no "reason" either.
+    """
+    
+    high_water = 0x10000
+    
+    def __init__(self, status, reason, msg, reader):
+        if status is None:
+            self.status = self.reason = None
+        else:
+            self.status = int(status)
+            self.reason = reason.decode("latin-1")
         self.msg = msg
+        self.reader = reader
+        self.complete = Future(loop=reader.sock.loop)
+    
+    def close(self):
+        """Abandon any remaining body; the connection is not reusable"""
+        if not self.complete.done():
+            self.complete.set_result(False)
+    
+    async def read(self, amt=None):
+        """Returns up to "amt" bytes, or the rest of the body if None
+        
+        An empty result means the end of the body."""
+        
+        if amt is not None:
+            return await self._read(amt)
+        data = bytearray()
+        while True:
+            chunk = await self._read(self.high_water)
+            if not chunk:
+                return bytes(data)
+            data.extend(chunk)
+    
+    async def readexactly(self, size):
+        """Raises asyncio.IncompleteReadError if the body ends early"""
+        data = bytearray()
+        while len(data) < size:
+            chunk = await self._read(size - len(data))
+            if not chunk:
+                raise IncompleteReadError(bytes(data), size)
+            data.extend(chunk)
+        return bytes(data)
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        data = await self._read(self.high_water)
+        if not data:
+            raise StopAsyncIteration()
+        return data
 
 class _EofResponse(HTTPResponse):
-    def __init__(self, status, reason, msg, sock):
-        HTTPResponse.__init__(self, status, reason, msg)
-        self.sock = sock
+    async def _read(self, amt):
+        data = await self.reader.read(amt)
+        if not data:
+            self.close()
+        return data
     
-    def read(self, amt):
-        return self.sock.recv(amt)
+    async def readinto(self, b):
+        size = await self.reader.readinto(b)
+        if not size:
+            self.close()
+        return size
 
 class _LengthResponse(HTTPResponse):
-    def __init__(self, status, reason, msg, sock, length, lengths):
-        HTTPResponse.__init__(self, status, reason, msg)
-        self.sock = sock
-        self.size = int(length)
+    def __init__(self, status, reason, msg, reader, length, lengths):
+        HTTPResponse.__init__(self, status, reason, msg, reader)
+        self.size = content_length(length)
         for dupe in lengths:
-            if int(dupe) != self.size:
+            if content_length(dupe) != self.size:
                 raise HTTPException("Conflicting Content-Length values")
+        if not self.size:
+            self.complete.set_result(True)
     
-    async def read(self, amt):
-        data = await self.sock.recv(min(self.size, amt))
-        self.size -= len(data)
+    async def _read(self, amt):
+        data = await self.reader.read(min(self.size, amt))
+        self._advance(len(data))
         return data
+    
+    async def readinto(self, b):
+        view = memoryview(b).cast("B")
+        if not view:
+            return 0
+        size = await self.reader.readinto(view[:self.size])
+        self._advance(size)
+        return size
+    
+    def _advance(self, size):
+        self.size -= size
+        if not self.size and not self.complete.done():
+            self.complete.set_result(True)
+        elif not size:
+            self.close()  # Premature EOF
+
+def content_length(value):
+    """Parses a "Content-Length" value, allowing only ASCII digits
+    
+    Signs and other forms accepted by int() would let a peer disagree
+    with us about where the body ends."""
+    
+    value = value.strip()
+    if not value or not value.isascii() or not value.isdigit():
+        raise HTTPException("Invalid Content-Length {!r}".format(value))
+    return int(value)
 
 class _ChunkedResponse(HTTPResponse):
-    def __init__(self, status, reason, msg, sock):
-        HTTPResponse.__init__(self, status, reason, msg)
-        self.sock = sock
-        self.chunk_read = None
-        sock.loop.create_task(self.Chunks())
-        self.size = None
+    """Decodes the chunked transfer coding as the body is read
     
-    async def read(self, amt):
-        if not self.size:
-            self.next_size = Future(loop=self.sock.loop)
-            if self.chunk_read:
-                self.chunk_read.set_result(None)
-            try:
-                [self.size, self.chunk_read] = await self.next_size
-            except EOFError:
-                return b""
-        data = await self.sock.recv(min(self.size, amt))
-        self.size -= len(data)
-        return data
+    Reads may span several chunks when their size lines are already
+    buffered. The trailer fields are parsed into "trailers" after the last
+    chunk.
+    """
     
-    async def Chunks(self):
-        """
-        Generator that returns chunk length
-        """
-        
-        for _ in range(30000):
-            parser = Parser(self.sock)
-            await parser.next_char()
-            if parser.c == b"\r":
-                await parser.next_char()
-            if parser.c == b"\n":
-                await parser.next_char()
-            await parser.space()
-            
-            size = 0
-            for _ in range(30):
-                try:
-                    digit = int(parser.c, 16)
-                except ValueError:
-                    break
-                size = size * 16 + digit
-                await parser.next_char()
-            else:
-                raise ExcessError("Chunk size of 30 or more digits")
-            
-            i = 0
-            while parser.c not in b"\n":  # Including EOF
-                i += 1
-                if i >= 3000:
-                    raise ExcessError("Line of 3000 or more characters")
-                await parser.next_char()
-            
-            if not size:
+    CHUNK_LIMIT = 30000
+    
+    def __init__(self, status, reason, msg, reader):
+        HTTPResponse.__init__(self, status, reason, msg, reader)
+        self.parser = Parser(reader)
+        self.size = 0  # Remaining in the current chunk
+        self.chunks = 0
+        self.eof = False
+        self.trailers = None
+    
+    async def _read(self, amt):
+        data = list()
+        total = 0
+        buffer = self.reader.buffer
+        while total < amt and await self._chunk_ready(total):
+            if not buffer and (total or not await self._fill()):
                 break
-            
-            chunk_read = Future(loop=self.sock.loop)
-            self.next_size.set_result((size, chunk_read))
-            await chunk_read
-        else:
-            raise ExcessError("30000 or more chunks")
+            chunk = self.reader.take(min(self.size, amt - total))
+            self.size -= len(chunk)
+            total += len(chunk)
+            data.append(chunk)
+        return b"".join(data)
+    
+    async def readinto(self, b):
+        view = memoryview(b).cast("B")
+        total = 0
+        buffer = self.reader.buffer
+        while total < len(view) and await self._chunk_ready(total):
+            if not buffer and (total or not await self._fill()):
+                break
+            size = min(self.size, len(view) - total, len(buffer))
+            view[total:total + size] = buffer[:size]
+            del buffer[:size]
+            self.size -= size
+            total += size
+        return total
+    
+    async def _chunk_ready(self, have_data):
+        """Returns True when there is data left in the current chunk
+        
+        If some data has already been read, a new chunk is only started
+        if its size line is buffered, so that the read does not block."""
         
-        self.next_size.set_exception(EOFError())
-        await parser.headers()
+        if self.size:
+            return True
+        if self.eof or have_data and not self._size_buffered():
+            return False
+        try:
+            if self.chunks >= self.CHUNK_LIMIT:
+                raise ExcessError("{} or more chunks".format(
+                    self.CHUNK_LIMIT))
+            size = await self.parser.chunk_size()
+            self.chunks += 1
+            if size is None:  # Premature EOF
+                self.eof = True
+                self.close()
+                return False
+            if size:
+                self.size = size
+                return True
+            self.eof = True
+            self.trailers = await self.parser.headers()
+        except:
+            self.eof = True
+            self.close()
+            raise
+        if not self.complete.done():
+            self.complete.set_result(True)
+        return False
+    
+    def _size_buffered(self):
+        buffer = self.reader.buffer
+        start = 0  # Skip the end of the previous chunk
+        if buffer.startswith(b"\n"):
+            start = 1
+        elif buffer.startswith(b"\r\n"):
+            start = 2
+        return buffer.find(b"\n", start) >= 0
+    
+    async def _fill(self):
+        if await self.reader.fill():
+            return True
+        self.size = 0
+        self.eof = True
+        self.close()  # Premature EOF
+        return False
 
-class Parser:
+class DecodedResponse(HTTPResponse):
+    """Decodes the content coding of another response as it is read
+    
+    See "net.ContentDecoder". The status, headers and "complete" future
+    are shared with the original response.
     """
-    "c" may hold last read character; empty string at EOF
+    
+    def __init__(self, response, decoder):
+        self.response = response
+        self.decoder = decoder
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+        self.reader = response.reader
+        self.complete = response.complete
+        self._drained = False  # Encoded body all read
+    
+    async def _read(self, amt):
+        if not amt:
+            return b""
+        while not self.decoder.eof:
+            data = b""
+            if self.decoder.needs_input and not self._drained:
+                data = await self.response._read(self.high_water)
+                self._drained = not data
+            data = self.decoder.decode(data, amt)
+            if data:
+                return data
+            if self._drained:
+                if self.decoder.empty:
+                    return b""  # No body at all
+                raise EOFError("Compressed response body is truncated")
+        return b""
+    
+    async def readinto(self, b):
+        view = memoryview(b).cast("B")
+        data = await self._read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+def decode_response(response):
+    """Wraps a response if it has a supported "Content-Encoding"
+    
+    Otherwise the response is returned unchanged."""
+    
+    decoder = net.content_decoder(response.msg)
+    if decoder is None:
+        return response
+    return DecodedResponse(response, decoder)
+
+class Parser:
+    """Parses the lines of a message head, using a buffered "Reader"
     """
     
-    def __init__(self, sock):
-        self.sock = sock
+    def __init__(self, reader):
+        self.reader = reader
     
     SPACE_LIMIT = 8
     TOKEN_LIMIT = 120
     NUMBER_LIMIT = 9
+    REASON_LIMIT = 400
+    HEADER_LIMIT = 30000  # Bytes in the whole header section
     
-    async def headers(self):
-        """
-        Entry with self.c = first character of headers
-        Leaves with self.c not set
-        """
+    async def status_line(self):
+        """Returns (major, status, reason) as byte strings"""
         
-        parser = email.parser.FeedParser()
+        limit = (self.SPACE_LIMIT * 3 + len(b"HTTP/.") +
+            self.NUMBER_LIMIT * 2 + self.TOKEN_LIMIT + 3 +
+            self.REASON_LIMIT + len(CRLF))
+        truncated = False
+        try:
+            line = await self.reader.readline(limit)
+        except ExcessError as e:
+            [line, truncated] = (e.data, True)
+        
+        # if response does not begin "HTTP/n.n 999 ", assume HTTP/0.9
+        # simple-response
+        match = STATUS_LINE.match(line)
+        if (not match or
+                len(match.group("pre_space")) >= self.SPACE_LIMIT or
+                len(match.group("major")) >= self.NUMBER_LIMIT or
+                len(match.group("minor")) >= self.NUMBER_LIMIT or
+                len(match.group("token")) >= self.TOKEN_LIMIT or
+                len(match.group("mid_space")) >= self.SPACE_LIMIT):
+            raise BadStatusLine(line)
+        
+        reason = match.group("reason")
+        while (not truncated and len(reason) <= self.REASON_LIMIT and
+                reason.endswith(b"\n") and await self.at_lws()):
+            # Continuation line
+            limit = self.REASON_LIMIT + 1 - len(reason)
+            try:
+                reason += await self.reader.readline(limit)
+            except ExcessError as e:
+                [reason, truncated] = (reason + e.data, True)
+        if truncated or len(reason) > self.REASON_LIMIT:
+            raise ExcessError("Status reason of 400 or more characters")
+        return (match.group("major"), match.group("status"), reason.strip())
+    
+    TARGET_LIMIT = 8000
+    
+    async def request_line(self):
+        """Returns (method, target, major, minor) as byte strings
+        
+        Returns None at EOF. A blank line before the request line is
+        skipped."""
         
-        blank_line = True
+        limit = (self.TOKEN_LIMIT + self.TARGET_LIMIT + len(b"  HTTP/.") +
+            self.NUMBER_LIMIT * 2 + len(CRLF))
+        line = await self.reader.readline(limit)
+        if line in {b"\r\n", b"\n"}:
+            line = await self.reader.readline(limit)
+        if not line:
+            return None
+        match = REQUEST_LINE.match(line)
+        if (not match or
+                len(match.group("method")) >= self.TOKEN_LIMIT or
+                len(match.group("major")) >= self.NUMBER_LIMIT or
+                len(match.group("minor")) >= self.NUMBER_LIMIT):
+            raise BadRequestLine(line)
+        return match.group("method", "target", "major", "minor")
+    
+    async def headers(self):
+        """Reads header lines up to and including the blank line"""
+        
+        lines = list()
+        remaining = self.HEADER_LIMIT
         for _ in range(30000):
-            if not self.c:
+            try:
+                line = await self.reader.readline(remaining)
+            except ExcessError as e:
+                msg = "Header section of {} or more bytes"
+                raise ExcessError(msg.format(self.HEADER_LIMIT), e.data)
+            remaining -= len(line)
+            lines.append(line)
+            if not line.rstrip(CRLF):  # Including EOF
                 break
-            parser.feed(self.c.decode("latin-1"))
-            if self.c == b"\n":
-                if blank_line:
-                    break
-                blank_line = True
-            elif self.c != b"\r":
-                blank_line = False
-            await self.next_char()
         else:
             raise ExcessError("30000 or more headers")
+        parser = email.parser.FeedParser()
+        parser.feed(b"".join(lines).decode("latin-1"))
         return parser.close()
     
-    async def space(self):
-        """Read and skip over spaces
+    async def chunk_size(self):
+        """Reads a chunk-size line, skipping the end of any previous chunk
+        
+        Returns None at EOF."""
+        
+        line = await self.reader.readline(3000)
+        if line in {b"\r\n", b"\n"}:
+            line = await self.reader.readline(3000)
+        if not line:
+            return None
+        match = CHUNK_SIZE.match(line)
+        size = match.group("size")
+        if len(size) >= 30:
+            raise ExcessError("Chunk size of 30 or more digits")
+        return int(size or b"0", 16)
+    
+    async def at_lws(self):
+        c = await self.reader.peek()
+        return c.isspace() and c not in CRLF
+
+class Reader:
+    """Buffers data received from a socket
+    
+    Lines are found by scanning each received block, rather than reading
+    one byte per call.
+    """
+    
+    BUFFER_SIZE = 0x10000
+    
+    def __init__(self, sock, bufsize=BUFFER_SIZE):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buffer = bytearray()
+    
+    async def fill(self):
+        """Receives more data into the buffer; returns False at EOF"""
+        data = await self.sock.recv(self.bufsize)
+        self.buffer.extend(data)
+        return bool(data)
+    
+    def take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+    
+    async def readline(self, limit):
+        """Reads a line, including the LF terminator
         
-        Entry with c = any char
+        If EOF is reached first, the partial line is returned. Raises
+        ExcessError if there is no LF within "limit" bytes.
         """
         
-        space = bytearray()
-        for i in range(self.SPACE_LIMIT):
-            if i:
-                await self.next_char()
-            if not self.at_lws():
-                return bytes(space)
-            space.extend(self.c)
-        else:
-            raise ExcessError("Excessive space", bytes(space))
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start, limit)
+            if end >= 0:
+                return self.take(end + 1)
+            if len(self.buffer) >= limit:
+                raise ExcessError("Line of {} or more characters".format(
+                    limit), bytes(self.buffer[:limit]))
+            start = len(self.buffer)
+            if not await self.fill():
+                return self.take(len(self.buffer))
+    
+    async def peek(self):
+        """Returns the next byte without consuming it; empty at EOF"""
+        if not self.buffer:
+            await self.fill()
+        return bytes(self.buffer[:1])
     
-    def at_lws(self):
-        return self.c.isspace() and self.c not in CRLF
+    async def read(self, amt):
+        if self.buffer:
+            return self.take(amt)
+        return await self.sock.recv(amt)
     
-    async def next_char(self):
-        self.c = await self.sock.recv(1)
+    async def readinto(self, b):
+        """Copies buffered data, otherwise receives directly"""
+        if not self.buffer:
+            return await self.sock.recv_into(b)
+        view = memoryview(b).cast("B")
+        size = min(len(view), len(self.buffer))
+        view[:size] = self.buffer[:size]
+        del self.buffer[:size]
+        return size
 
 class ExcessError(EnvironmentError):
     def __init__(self, msg, data=None):
@@ -308,4 +550,23 @@ class BadStatusLine(http.client.BadStatusLine):
     def __init__(self, line):
         Exception.__init__(self, repr(line))
 
+class BadRequestLine(HTTPException):
+    def __init__(self, line):
+        Exception.__init__(self, repr(line))
+
 CRLF = b"\r\n"
+
+CONTROLS = bytes(range(ord(b" ") + 1))
+CONTROL_PATTERN = re.compile(b"[" + re.escape(CONTROLS) + b"]")
+
+def escape_control(match):
+    return "%{:02X}".format(ord(match.group())).encode("ascii")
+
+STATUS_LINE = re.compile(br"""(?P<pre_space>[ \t]*)
+    HTTP/(?P<major>[0-9]+)\.(?P<minor>[0-9]*)(?P<token>[^\s]*)
+    (?P<mid_space>[ \t]+)(?P<status>[0-9]{3})[ \t]*(?P<reason>.*)""",
+    re.VERBOSE | re.DOTALL)
+REQUEST_LINE = re.compile(br"""(?P<method>[!#$%&'*+.^_`|~0-9A-Za-z-]+)
+    [ ](?P<target>[^\s]+)[ ]HTTP/(?P<major>[0-9]+)\.(?P<minor>[0-9]+)
+    \r?\n$""", re.VERBOSE)
+CHUNK_SIZE = re.compile(br"[ \t]*(?P<size>[0-9A-Fa-f]*)")
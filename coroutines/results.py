@@ -48,7 +48,7 @@ class RaiseResult(Result):
         self._exc = exc
         
         # Traceback attribute available since Python 3
-        self._traceback = getattr(self.exception, "__traceback__", None)
+        self._traceback = getattr(exc, "__traceback__", None)
     
     @classmethod
     def from_exc_info(cls):
@@ -0,0 +1,138 @@
+"""Headless event loop driven by the "selectors" module"""
+
+import selectors
+from selectors import EVENT_READ, EVENT_WRITE
+import asyncio
+from asyncio.events import _get_running_loop, _set_running_loop
+import threading
+from . import EventLoop as _EventLoop
+
+class EventLoop(_EventLoop):
+    """Runs callbacks, timers and file handlers without a GUI
+    
+    The default selector is used (epoll on Linux) unless another is
+    given."""
+    
+    def __init__(self, selector=None):
+        super().__init__()
+        if selector is None:
+            selector = selectors.DefaultSelector()
+        self._selector = selector
+        self._deadline = None  # From set_timer()
+        self._stopping = False
+    
+    def new_callbacks(self):
+        pass  # Checked by _poll() through "_invoke_pending"
+    
+    def set_timer(self, when):
+        self._deadline = when
+    
+    def stop(self):
+        self._stopping = True
+    
+    def run_forever(self):
+        self._check_closed()
+        if self.is_running():
+            raise RuntimeError("This event loop is already running")
+        # A selector may not see a file registered from another thread
+        # while it is waiting, so prepare for call_soon_threadsafe() here
+        if self._wakeup is None:
+            self._create_wakeup()
+        self._thread_id = threading.get_ident()
+        old_loop = _get_running_loop()
+        _set_running_loop(self)
+        try:
+            while not self._stopping:
+                self._poll()
+        finally:
+            self._stopping = False
+            self._thread_id = None
+            _set_running_loop(old_loop)
+    
+    def _poll(self):
+        if self._invoke_pending:
+            timeout = 0
+        elif self._deadline is not None:
+            timeout = max(self._deadline - self.time(), 0)
+        else:
+            timeout = None
+        
+        for [key, mask] in self._selector.select(timeout):
+            [reader, writer] = key.data
+            if mask & EVENT_READ and reader is not None:
+                if reader._cancelled:
+                    self._remove(key.fd, EVENT_READ)
+                else:
+                    reader._run()
+            if mask & EVENT_WRITE and writer is not None:
+                if writer._cancelled:
+                    self._remove(key.fd, EVENT_WRITE)
+                else:
+                    writer._run()
+        
+        if self._deadline is not None and self._deadline <= self.time():
+            self._deadline = None
+            self.expire_timers()
+        if self._invoke_pending:
+            self.invoke_callbacks()
+    
+    def add_reader(self, fd, callback, *args):
+        self._add(fd, EVENT_READ, callback, args)
+    def add_writer(self, fd, callback, *args):
+        self._add(fd, EVENT_WRITE, callback, args)
+    
+    def _add(self, fd, event, callback, args):
+        self._check_closed()
+        handle = asyncio.Handle(callback, args, self, None)
+        try:
+            key = self._selector.get_key(fd)
+        except KeyError:
+            data = (None, None)
+            events = 0
+        else:
+            data = key.data
+            events = key.events
+        [reader, writer] = data
+        if event == EVENT_READ:
+            [old, reader] = (reader, handle)
+        else:
+            [old, writer] = (writer, handle)
+        if events:
+            self._selector.modify(fd, events | event, (reader, writer))
+        else:
+            self._selector.register(fd, event, (reader, writer))
+        if old is not None:
+            old.cancel()
+    
+    def remove_reader(self, fd):
+        return self._remove(fd, EVENT_READ)
+    def remove_writer(self, fd):
+        return self._remove(fd, EVENT_WRITE)
+    
+    def _remove(self, fd, event):
+        if self.is_closed():
+            return False
+        try:
+            key = self._selector.get_key(fd)
+        except KeyError:
+            return False
+        [reader, writer] = key.data
+        if event == EVENT_READ:
+            [old, reader] = (reader, None)
+        else:
+            [old, writer] = (writer, None)
+        events = key.events & ~event
+        if events:
+            self._selector.modify(fd, events, (reader, writer))
+        else:
+            self._selector.unregister(fd)
+        if old is None:
+            return False
+        old.cancel()
+        return True
+    
+    def close(self):
+        super().close()
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
@@ -0,0 +1,346 @@
+"""HTTP/1.1 server running handler coroutines on an event loop
+
+async def handler(request, response):
+    body = await request.body.read()
+    response.headers.append(("Content-Type", "text/plain"))
+    await response.end(b"Hello")
+
+with Server(handler, loop=loop) as server:
+    server.listen(("", 8080))
+    loop.run_forever()
+
+Each connection is served by one task, so idle keep-alive connections
+only cost a socket and a suspended coroutine. Requests are parsed with
+"coroutines.http", and pipelined requests are answered in order.
+"""
+
+import socket
+import asyncio
+import sys
+import traceback
+import re
+from http.client import HTTPException, responses
+import net
+from misc import Context
+from . import http
+from .socket import Socket, Ssl
+
+class Server(Context):
+    """Accepts connections and calls "handler(request, response)"
+    
+    Errors are passed to handle_error(), which drops the same errors as
+    "net.Server.handle_error". The connection is then closed, after a
+    500 response if nothing was sent yet and the client seems to still be
+    connected.
+    
+    For "Expect: 100-continue", "100 Continue" is only sent when the handler
+    first reads the body. If the handler responds without reading it, the
+    connection is closed instead of waiting for the body.
+    """
+    
+    # Unread request body discarded to keep a connection alive
+    DRAIN_LIMIT = 0x10000
+    
+    def __init__(self, handler, *, loop, ssl_context=None):
+        self.handler = handler
+        self.loop = loop
+        self.ssl_context = ssl_context
+        self.server_address = None
+        self._listeners = list()  # [(Socket, task)]
+        self._connections = set()  # Tasks
+    
+    def listen(self, address, backlog=100):
+        """Binds and listens on a new socket"""
+        sock = socket.create_server(address, backlog=backlog)
+        self.serve(sock)
+    
+    def serve(self, sock):
+        """Accepts connections from a listening "socket.socket" object"""
+        if self.server_address is None:
+            self.server_address = sock.getsockname()
+        sock = Socket(fileno=sock.detach(), loop=self.loop, persistent=True)
+        task = self.loop.create_task(self._accept(sock))
+        self._listeners.append((sock, task))
+    
+    async def _accept(self, listener):
+        while True:
+            try:
+                [sock, address] = await listener.accept()
+            except ConnectionError:
+                continue  # Aborted before being accepted
+            task = self.loop.create_task(self._connection(sock, address))
+            self._connections.add(task)
+            task.add_done_callback(self._connections.discard)
+    
+    async def _connection(self, sock, address):
+        try:
+            if self.ssl_context is not None:
+                sock = Ssl(self.ssl_context, sock, server_side=True)
+                await sock.handshake()
+            reader = http.Reader(sock)
+            parser = http.Parser(reader)
+            while await self._request(sock, parser, address):
+                pass
+        except Exception:
+            self.handle_error(sock, address)
+        finally:
+            sock.close()
+    
+    async def _request(self, sock, parser, address):
+        """Serves one request; returns True to keep the connection"""
+        
+        try:
+            line = await parser.request_line()
+            if line is None:
+                return False
+            [method, target, major, minor] = line
+            msg = await parser.headers()
+            if int(major) != 1:
+                response = Response(sock, "GET", (1, 0), close=True)
+                await response.send_error(505)
+                return False
+            request = Request(method, target, (1, int(minor)), msg,
+                parser.reader)
+        except (HTTPException, http.ExcessError, ValueError):
+            response = Response(sock, "GET", (1, 0), close=True)
+            await response.send_error(400)
+            return False
+        
+        response = Response(sock, request.method, request.version,
+            close=request.close)
+        waiting = None
+        if request.expect_continue:
+            # Only ask for the body once the handler reads it
+            waiting = _Continue(sock, response)
+            parser.reader.sock = waiting
+        try:
+            await self.handler(request, response)
+        except Exception as exc:
+            if response.started or net.quiet_error(exc):
+                raise
+            self.handle_error(sock, address)
+            response = Response(sock, request.method, request.version,
+                close=True)
+            await response.send_error(500)
+            return False
+        await response.end()
+        if response.close:
+            return False
+        if waiting is not None:
+            parser.reader.sock = sock
+            if not waiting.sent and not request.body.complete.done():
+                return False  # Client may never send the body
+        return await self._drain(request.body)
+    
+    async def _drain(self, body):
+        size = 0
+        while not body.complete.done() and size <= self.DRAIN_LIMIT:
+            size += len(await body.read(self.DRAIN_LIMIT))
+        return body.complete.done() and body.complete.result()
+    
+    def handle_error(self, request, client_address):
+        [_, exc, *_] = sys.exc_info()
+        if net.quiet_error(exc):
+            return
+        print("-" * 40, file=sys.stderr)
+        print("Exception occurred during processing of request from",
+            client_address, file=sys.stderr)
+        traceback.print_exc()
+        print("-" * 40, file=sys.stderr)
+    
+    def close(self):
+        """Stops listening and cancels the connection tasks
+        
+        Await wait_closed() for the tasks to finish."""
+        for [sock, task] in self._listeners:
+            task.cancel()
+            sock.close()
+        for task in self._connections:
+            task.cancel()
+    
+    async def wait_closed(self):
+        tasks = [task for [_, task] in self._listeners]
+        tasks.extend(self._connections)
+        self._listeners.clear()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+class Request:
+    """Request line and header fields of a request
+    
+    The body is read from "body", an "http.HTTPResponse" object whose
+    "status" is None. A request with no body has an empty "body".
+    """
+    
+    def __init__(self, method, target, version, msg, reader):
+        self.method = method.decode("ascii")
+        self.target = target.decode("latin-1")
+        self.version = version
+        self.msg = msg
+        
+        connection = {token.strip().lower()
+            for token in net.header_list(msg, "Connection")}
+        self.close = "close" in connection or version < (1, 1)
+        expect = msg.get("Expect", "").strip().lower()
+        self.expect_continue = expect == "100-continue" and version >= (1, 1)
+        
+        encodings = list(net.header_list(msg, "Transfer-Encoding"))
+        if encodings:
+            if len(encodings) > 1 or encodings[0].strip().lower() != "chunked":
+                raise http.UnknownTransferEncoding(
+                    "Not chunked transfer encoding")
+            del msg["Transfer-Encoding"]
+            self.body = http._ChunkedResponse(None, None, msg, reader)
+        else:
+            lengths = net.header_list(msg, "Content-Length")
+            # An empty field still has to be rejected
+            length = next(lengths, msg.get("Content-Length", "0"))
+            self.body = http._LengthResponse(None, None, msg, reader,
+                length, lengths)
+        if self.body.complete.done():
+            self.expect_continue = False
+
+class _Continue:
+    """Sends "100 Continue" before first receiving from a socket
+    
+    Nothing is sent once the final response has started."""
+    
+    def __init__(self, sock, response):
+        self.sock = sock
+        self.response = response
+        self.sent = False
+    
+    async def recv(self, bufsize):
+        await self._send()
+        return await self.sock.recv(bufsize)
+    
+    async def recv_into(self, buffer):
+        await self._send()
+        return await self.sock.recv_into(buffer)
+    
+    async def _send(self):
+        if not self.sent and not self.response.started:
+            self.sent = True
+            await self.sock.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+class Response:
+    """Sends the response to one request
+    
+    Set "status", "reason" and "headers" (a list of (name, value) pairs),
+    then send the body with write() and end(). If end() is called before
+    anything is written, "Content-Length" is added, except for a HEAD
+    request with no data given. Otherwise the body is sent with the
+    chunked transfer coding unless "Content-Length" was given, or for
+    HTTP/1.0, by closing the connection. The header is only sent with the
+    first data, so that small responses go out in a single write.
+    
+    Setting "close" sends "Connection: close", and the connection is
+    closed after the response.
+    """
+    
+    def __init__(self, sock, method, version, *, close=False):
+        self.sock = sock
+        self.method = method
+        self.version = version
+        self.close = close
+        self.status = 200
+        self.reason = None
+        self.headers = list()
+        self.started = False
+        self.ended = False
+        self._chunked = False
+        self._remaining = None  # From "Content-Length"
+    
+    async def write(self, data):
+        buffers = list()
+        if not self.started:
+            buffers.append(self._head(None))
+        buffers.extend(self._frame(data))
+        await self.sock.sendmsg(buffers)
+    
+    async def end(self, data=b""):
+        """Sends any final data and finishes the response"""
+        if self.ended:
+            return
+        if self.started:
+            buffers = self._frame(data)
+            if self._chunked and self._has_body():
+                buffers.append(b"0\r\n\r\n")
+        else:
+            length = len(data)
+            if self.method == "HEAD" and not data:
+                length = None  # Length of the GET response is not known
+            buffers = [self._head(length)]
+            if self._has_body():
+                buffers.append(data)
+            self._remaining = None
+        await self.sock.sendmsg(buffers)
+        if self._remaining:
+            self.close = True  # Body shorter than "Content-Length"
+        self.ended = True
+    
+    async def send_error(self, status):
+        self.status = status
+        self.headers = [("Content-Type", "text/plain")]
+        body = "{} {}\r\n".format(status, responses.get(status, ""))
+        await self.end(body.encode("ascii"))
+    
+    def _frame(self, data):
+        if not data or not self._has_body():
+            return []
+        if self._chunked:
+            return [b"%X\r\n" % len(data), data, http.CRLF]
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return [data]
+    
+    def _has_body(self):
+        return (self.method != "HEAD" and self.status >= 200 and
+            self.status not in {204, 304})
+    
+    def _head(self, length):
+        for [name, value] in self.headers:
+            if not HEADER_NAME.fullmatch(name):
+                raise ValueError("Invalid header name {!r}".format(name))
+            if HEADER_VALUE_ILLEGAL.search(value):
+                raise ValueError("Invalid header value {!r}".format(value))
+        self.started = True
+        reason = self.reason
+        if reason is None:
+            reason = responses.get(self.status, "")
+        head = bytearray(b"HTTP/1.1 %d " % self.status)
+        head.extend(reason.encode("latin-1"))
+        head.extend(http.CRLF)
+        
+        lengths = [value for [name, value] in self.headers
+            if name.lower() == "content-length"]
+        if lengths:
+            self._remaining = int(lengths[0])
+        elif self.status >= 200 and self.status not in {204, 304}:
+            if length is not None:
+                self.headers.append(("Content-Length", format(length)))
+            elif self.method == "HEAD":
+                pass  # No body to delimit
+            elif self.version >= (1, 1):
+                self._chunked = True
+                self.headers.append(("Transfer-Encoding", "chunked"))
+            else:
+                self.close = True  # Body delimited by closing
+        close_sent = False
+        for [name, value] in self.headers:
+            if name.lower() == "connection" and "close" in value.lower():
+                self.close = close_sent = True
+        if self.close and not close_sent:
+            self.headers.append(("Connection", "close"))
+        
+        for [name, value] in self.headers:
+            head.extend(name.encode("ascii"))
+            head.extend(b": ")
+            head.extend(value.encode("latin-1"))
+            head.extend(http.CRLF)
+        head.extend(http.CRLF)
+        return head
+
+# As checked by "http.client.HTTPConnection.putheader", so that a
+# CR or LF cannot start another field or the body
+HEADER_NAME = re.compile(r"[^:\s][^:\r\n]*")
+HEADER_VALUE_ILLEGAL = re.compile(r"\n(?![ \t])|\r(?![ \t\n])")
@@ -3,14 +3,39 @@ import ssl
 from ssl import SSLWantReadError, SSLWantWriteError
 from misc import Context
 from asyncio import Future
+import os
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+SENDFILE_BLOCK = 0x40000
 
 class Socket(Context):
-    """Provides coroutines for common blocking socket operations"""
+    """Provides coroutines for common blocking socket operations
+    
+    With persistent=True, the file descriptor stays registered with the
+    event loop between operations, rather than being added and removed
+    for each wait. The event loop must keep reader and writer callbacks
+    registered until they are removed."""
     
-    def __init__(self, *args, loop, **kw):
+    def __init__(self, *args, loop, persistent=False, **kw):
         self.loop = loop
         self.sock = socket.socket(*args, **kw)
         self.sock.setblocking(False)
+        self._init_watchers(persistent)
+    
+    def _init_watchers(self, persistent):
+        if persistent:
+            fd = self.sock.fileno()
+            self._reading = Readiness(self.loop, fd,
+                self.loop.add_reader, self.loop.remove_reader)
+            self._writing = Readiness(self.loop, fd,
+                self.loop.add_writer, self.loop.remove_writer)
+        else:
+            self._reading = None
+            self._writing = None
     
     async def connect(self, *args, **kw):
         while True:
@@ -19,9 +44,23 @@ class Socket(Context):
                 break
             except BlockingIOError:
                 pass
-            future = Future(loop=self.loop)
-            self.loop.add_writer(self.sock.fileno(), future.set_result, None)
-            await future
+            await self._writable()
+    
+    async def accept(self):
+        """Returns (Socket, address) for a new connection
+        
+        The new socket is persistent if this one is."""
+        
+        while True:
+            try:
+                [sock, address] = self.sock.accept()
+                break
+            except BlockingIOError:
+                pass
+            await self._readable()
+        sock = Socket(fileno=sock.detach(), loop=self.loop,
+            persistent=self._reading is not None)
+        return (sock, address)
     
     async def recv(self, *args, **kw):
         while True:
@@ -29,29 +68,134 @@ class Socket(Context):
                 return self.sock.recv(*args, **kw)
             except (BlockingIOError, SSLWantReadError):
                 pass
-            future = Future(loop=self.loop)
-            self.loop.add_reader(self.sock.fileno(), future.set_result, None)
-            await future
+            await self._readable()
+    
+    async def recv_into(self, buffer, *args, **kw):
+        while True:
+            try:
+                return self.sock.recv_into(buffer, *args, **kw)
+            except (BlockingIOError, SSLWantReadError):
+                pass
+            await self._readable()
+    
+    async def recv_exactly(self, buffer):
+        """Fills the whole buffer, or raises EOFError"""
+        buffer = memoryview(buffer).cast("B")
+        while buffer:
+            size = await self.recv_into(buffer)
+            if not size:
+                raise EOFError()
+            buffer = buffer[size:]
     
     async def sendall(self, data, *args, **kw):
+        data = memoryview(data).cast("B")
         while data:
             try:
-                data = data[self.sock.send(data, *args, **kw):]
-                break
+                sent = self.sock.send(data, *args, **kw)
             except SSLWantReadError:
-                future = Future(loop=self.loop)
-                self.loop.add_reader(self.sock.fileno(), future.set_result,
-                    None)
-                await future
+                await self._readable()
+                continue
+            except (BlockingIOError, SSLWantWriteError):
+                await self._writable()
+                continue
+            data = data[sent:]  # Slicing a memoryview does not copy
+    
+    async def sendmsg(self, buffers):
+        """Sends all data from a sequence of buffers
+        
+        Uses vectored writes, so that separate buffers do not have to be
+        concatenated or sent with separate system calls."""
+        
+        buffers = [memoryview(b).cast("B") for b in buffers if len(b)]
+        while buffers:
+            try:
+                sent = self.sock.sendmsg(buffers[:IOV_MAX])
+            except BlockingIOError:
+                await self._writable()
+                continue
+            while sent:
+                if sent < len(buffers[0]):
+                    buffers[0] = buffers[0][sent:]
+                    break
+                sent -= len(buffers.pop(0))
+    
+    async def sendfile(self, file, offset=0, count=None):
+        """Sends data from a file using os.sendfile(); returns the size sent
+        
+        Sends until EOF unless "count" is given. The file position is not
+        changed."""
+        
+        sent = 0
+        while count is None or sent < count:
+            size = SENDFILE_BLOCK
+            if count is not None:
+                size = min(size, count - sent)
+            try:
+                size = os.sendfile(self.sock.fileno(), file.fileno(),
+                    offset + sent, size)
+            except BlockingIOError:
+                await self._writable()
+                continue
+            if not size:
+                break  # EOF
+            sent += size
+        return sent
+    
+    def _readable(self):
+        if self._reading is not None:
+            return self._reading
+        return self._wait(self.loop.add_reader, self.loop.remove_reader)
+    
+    def _writable(self):
+        if self._writing is not None:
+            return self._writing
+        return self._wait(self.loop.add_writer, self.loop.remove_writer)
+    
+    async def _wait(self, add, remove):
+        future = Future(loop=self.loop)
+        fd = self.sock.fileno()  # Becomes -1 if closed while waiting
+        add(fd, future.set_result, None)
+        try:
+            await future
+        finally:
+            remove(fd)
     
     def close(self, *args, **kw):
+        for watcher in (self._reading, self._writing):
+            if watcher is not None:
+                watcher.close()
         self.sock.close(*args, **kw)
 
 class Ssl(Socket):
-    def __init__(self, context, socket):
+    def __init__(self, context, socket, **kw):
         self.loop = socket.loop
         self.sock = context.wrap_socket(socket.sock,
-            do_handshake_on_connect=False)
+            do_handshake_on_connect=False, **kw)
+        # Same file descriptor as the wrapped socket
+        self._reading = socket._reading
+        self._writing = socket._writing
+    
+    async def sendmsg(self, buffers):
+        # SSL sockets do not implement sendmsg()
+        await self.sendall(b"".join(buffers))
+    
+    async def sendfile(self, file, offset=0, count=None):
+        """Reads the file into one reused buffer, since the data has to be
+        encrypted"""
+        
+        buffer = bytearray(SENDFILE_BLOCK)
+        view = memoryview(buffer)
+        sent = 0
+        while count is None or sent < count:
+            size = SENDFILE_BLOCK
+            if count is not None:
+                size = min(size, count - sent)
+            size = os.preadv(file.fileno(), (view[:size],), offset + sent)
+            if not size:
+                break  # EOF
+            await self.sendall(view[:size])
+            sent += size
+        return sent
     
     async def handshake(self, *args, **kw):
         while True:
@@ -59,9 +203,43 @@ class Ssl(Socket):
                 self.sock.do_handshake(*args, **kw)
                 break
             except SSLWantReadError:
-                add_watcher = self.loop.add_reader
+                await self._readable()
             except SSLWantWriteError:
-                add_watcher = self.loop.add_writer
-            future = Future(loop=self.loop)
-            add_watcher(self.sock.fileno(), future.set_result, None)
-            await future
+                await self._writable()
+
+class Readiness:
+    """Reusable awaitable for a file descriptor becoming ready
+    
+    The callback stays registered with the event loop between waits, and
+    sets a future created for each wait. It is only unregistered if it is
+    called with nothing waiting, so that level-triggered readiness does not
+    cause repeated callbacks."""
+    
+    def __init__(self, loop, fd, add, remove):
+        self._loop = loop
+        self.fd = fd
+        self.add = add
+        self.remove = remove
+        self.registered = False
+        self._waiters = list()  # Futures, possibly cancelled
+    
+    def __await__(self):
+        if not self.registered:
+            self.add(self.fd, self._ready)
+            self.registered = True
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        return (yield from waiter)
+    
+    def _ready(self):
+        [waiters, self._waiters] = (self._waiters, list())
+        waiters = [waiter for waiter in waiters if not waiter.done()]
+        if not waiters:
+            self.close()
+        for waiter in waiters:
+            waiter.set_result(None)
+    
+    def close(self):
+        if self.registered:
+            self.remove(self.fd)
+            self.registered = False
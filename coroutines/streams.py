@@ -0,0 +1,32 @@
+"""Asynchronous counterparts of the "streams" module"""
+
+from inspect import isawaitable
+
+async def streamcopy(input, write, length=None, *, bufsize=0x10000):
+    """Copies from "input.readinto" to "write" through one buffer
+    
+    The "write" function, such as a file's write() method or
+    "coroutines.socket.Socket.sendall", may return an awaitable. It must
+    be finished with the data before it returns, since the buffer is
+    reused. Copies "length" bytes, raising EOFError if the input ends
+    first, or until the end of the input if "length" is None. Returns the
+    number of bytes copied."""
+    
+    if length is not None and length < 0:
+        raise ValueError("Negative length")
+    buffer = memoryview(bytearray(bufsize))
+    copied = 0
+    while length is None or copied < length:
+        size = bufsize
+        if length is not None:
+            size = min(size, length - copied)
+        size = await input.readinto(buffer[:size])
+        if not size:
+            if length is not None:
+                raise EOFError()
+            break
+        result = write(buffer[:size])
+        if isawaitable(result):
+            await result
+        copied += size
+    return copied
@@ -7,14 +7,23 @@ from warnings import warn
 from . import EventLoop as _EventLoop
 from traceback import format_exception
 import tkinter
+import threading
 from tkwrap import scroll
 from functools import partial
 
 class EventLoop(_EventLoop):
+    # Milliseconds between checks for call_soon_threadsafe() callbacks
+    # where Tk has no file handlers (Windows)
+    wakeup_poll = 50
+    
     def __init__(self, widget):
         super().__init__()
         self._widget = widget
-        self._filehandlers = dict()
+        self._thread = threading.get_ident()  # Running the Tcl interpreter
+        self._filehandlers = dict()  # {fd: {mask: callback}}
+        self._filemasks = dict()  # {fd: mask registered with Tk}
+        self._after = None  # Tk timer for the earliest asyncio timer
+        self._wakeup_after = None  # Polling timer without file handlers
     
     def run_forever(self):
         self._widget.mainloop()
@@ -25,6 +34,43 @@ class EventLoop(_EventLoop):
     def stop(self):
         self._widget.quit()
     
+    def set_timer(self, when):
+        if self._after is not None:
+            self._widget.after_cancel(self._after)
+        delay = max(ceil((when - self.time()) * 1000), 0)
+        self._after = self._widget.after(delay, self._expire)
+    
+    def _expire(self):
+        self._after = None
+        self.expire_timers()
+    
+    def _watch_wakeup(self, fd):
+        if threading.get_ident() != self._thread:
+            # Unlike file handlers, "after" is passed on to the Tcl thread
+            self._widget.after_idle(self._watch_wakeup, fd)
+        elif hasattr(self._widget.tk, "createfilehandler"):
+            self.add_reader(fd, self._read_wakeup)
+        else:
+            self._poll_wakeup()
+    
+    def _poll_wakeup(self):
+        self._read_wakeup()
+        self._wakeup_after = self._widget.after(self.wakeup_poll,
+            self._poll_wakeup)
+    
+    def _unwatch_wakeup(self, fd):
+        if self._wakeup_after is not None:
+            self._widget.after_cancel(self._wakeup_after)
+            self._wakeup_after = None
+        else:
+            self.remove_reader(fd)
+    
+    def close(self):
+        if self._after is not None:
+            self._widget.after_cancel(self._after)
+            self._after = None
+        super().close()
+    
     def default_exception_handler(self, context):
         super().default_exception_handler(context)
         
@@ -51,40 +97,66 @@ class EventLoop(_EventLoop):
         return self._add_filehandler(tkinter.WRITABLE, *pos, **kw)
     def _add_filehandler(self, mask, fd, callback, *pos, **kw):
         callbacks = self._filehandlers.setdefault(fd, dict())
-        if callbacks:
-            self._widget.tk.deletefilehandler(fd)
         callbacks[mask] = partial(callback, *pos, **kw)
-        mask = reduce(operator.or_, callbacks.keys())
-        self._widget.tk.createfilehandler(fd, mask, self._filehandler)
+        registered = self._filemasks.get(fd, 0)
+        if mask & ~registered:
+            # Replaces any existing handler for the file descriptor
+            self._filemasks[fd] = registered | mask
+            self._widget.tk.createfilehandler(fd, registered | mask,
+                self._filehandler)
     
     def remove_reader(self, *pos, **kw):
         return self._remove_filehandler(tkinter.READABLE, *pos, **kw)
     def remove_writer(self, *pos, **kw):
         return self._remove_filehandler(tkinter.WRITABLE, *pos, **kw)
     def _remove_filehandler(self, mask, fd):
-        callbacks = self._filehandlers[fd]
-        del callbacks[mask]
+        callbacks = self._filehandlers.get(fd)
+        if not callbacks or callbacks.pop(mask, None) is None:
+            return False
         if not callbacks:
+            # Delete straight away, because the file may be closed next
             self._widget.tk.deletefilehandler(fd)
             del self._filehandlers[fd]
+            del self._filemasks[fd]
+        # Otherwise the handler's mask is reduced by the next event
+        return True
     
     def _filehandler(self, fd, mask):
-        self._widget.tk.deletefilehandler(fd)
-        callbacks = self._filehandlers.pop(fd)
-        for (cbmask, callback) in callbacks.items():
+        callbacks = self._filehandlers.get(fd, {})
+        for (cbmask, callback) in list(callbacks.items()):
             if mask & cbmask:
                 callback()
+        
+        callbacks = self._filehandlers.get(fd)
+        if callbacks is None:
+            return
+        current = reduce(operator.or_, callbacks.keys())
+        if self._filemasks[fd] != current:
+            self._filemasks[fd] = current
+            self._widget.tk.createfilehandler(fd, current, self._filehandler)
 
 class Timer(Event):
-    def __init__(self):
+    """Event triggered after a timeout
+    
+    If "loop" is given, its call_later() is used, sharing its single Tk
+    timer. Otherwise a Tk timer is created on the "widget" attribute."""
+    
+    def __init__(self, loop=None):
         Event.__init__(self)
+        self.loop = loop
         self.timer = None
     
     def start(self, timeout):
-        self.timer = self.widget.after(ceil(timeout * 1000), self.handler)
+        if self.loop is None:
+            self.timer = self.widget.after(ceil(timeout * 1000), self.handler)
+        else:
+            self.timer = self.loop.call_later(timeout, self.handler)
     
     def stop(self):
-        self.widget.after_cancel(self.timer)
+        if self.loop is None:
+            self.widget.after_cancel(self.timer)
+        else:
+            self.timer.cancel()
         self.timer = None
     
     @weakmethod
@@ -10,6 +10,25 @@ from errno import EPIPE, ENOTCONN, ECONNRESET
 from select import select
 from contextlib import contextmanager
 from streams import DelegateWriter
+from threading import Lock, local, Event, Thread
+from collections import OrderedDict, deque
+from time import monotonic, sleep
+import weakref
+import os
+import signal
+import socket
+import traceback
+import zlib
+import io
+
+try:
+    import bz2
+except ImportError:  # Optional in some builds
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 try:  # Python 3.3
     ConnectionError
@@ -141,29 +160,155 @@ def header_unquote(header):
     return "".join(segments)
 
 class Server(BaseServer, Context):
+    """Base class adding multi-process serving to "socketserver" servers
+    
+    serve_workers() forks processes that each run serve_forever() with the
+    existing request handler, and restarts any that exit. Workers share
+    the listening socket unless "reuse_port" is set, in which case each
+    binds its own socket with SO_REUSEPORT and the kernel spreads
+    connections between them. The server's own socket then does not
+    listen, so serve_forever() cannot be used.
+    """
+    
     default_port = 0
+    reuse_port = False
+    
+    # Seconds for workers to finish their requests before being killed
+    worker_timeout = 10
     
     def __init__(self, address=("", None), RequestHandlerClass=None):
         [host, port] = address
         if port is None:
             port = self.default_port
+        self._workers = set()  # Process IDs
+        self._stopping = None  # Event while serve_workers() is running
+        self._supervised = None  # Event set once serve_workers() is done
         super().__init__((host, port), RequestHandlerClass)
     
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def server_activate(self):
+        # With "reuse_port", the bound socket only reserves the address;
+        # connections to it would never be accepted
+        if not self.reuse_port:
+            super().server_activate()
+    
     def close(self):
         return self.server_close()
     
+    def server_close(self):
+        """Also stops any workers, letting them finish current requests"""
+        if self._stopping is not None:
+            self._stopping.set()
+            self._supervised.wait()
+        super().server_close()
+    
+    def serve_workers(self, workers, poll_interval=0.5):
+        """Runs "workers" processes until close() is called
+        
+        Exited workers are restarted within "poll_interval" seconds. On
+        return, including by an exception such as KeyboardInterrupt, the
+        workers are sent SIGTERM, and are killed if they do not exit
+        within "worker_timeout" seconds.
+        """
+        
+        self._stopping = Event()
+        self._supervised = Event()
+        try:
+            for _ in range(workers):
+                self._start_worker(poll_interval)
+            while not self._stopping.wait(poll_interval):
+                for pid in self._reap():
+                    self._start_worker(poll_interval)
+        finally:
+            try:
+                self._stop_workers()
+            finally:
+                self._supervised.set()
+    
+    def _start_worker(self, poll_interval):
+        pid = os.fork()
+        if pid:
+            self._workers.add(pid)
+            return
+        
+        status = 1
+        try:
+            self._workers.clear()
+            self._stopping = None
+            self._supervised = None
+            # The parent handles interruption by stopping the workers
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self._terminate_worker)
+            if self.reuse_port:
+                self._bind_worker()
+            self.serve_forever(poll_interval)
+            self.server_close()
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    
+    def _bind_worker(self):
+        sock = socket.socket(self.socket.family, self.socket.type)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(self.server_address)
+            sock.listen(self.request_queue_size)
+        except:
+            sock.close()
+            raise
+        self.socket.close()
+        self.socket = sock
+    
+    def _terminate_worker(self, signum, frame):
+        # shutdown() waits for serve_forever(), so cannot be called here
+        Thread(target=self.shutdown).start()
+    
+    def _reap(self):
+        """Returns the process IDs of exited workers"""
+        exited = [pid for pid in self._workers
+            if os.waitpid(pid, os.WNOHANG)[0]]
+        self._workers.difference_update(exited)
+        return exited
+    
+    def _stop_workers(self):
+        for pid in self._workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = monotonic() + self.worker_timeout
+        while self._workers and monotonic() < deadline:
+            self._reap()
+            if self._workers:
+                sleep(0.05)
+        for pid in self._workers:
+            os.kill(pid, signal.SIGKILL)
+        while self._workers:
+            os.waitpid(self._workers.pop(), 0)
+    
     def handle_error(self, request, client_address):
         [_, exc, *_] = sys.exc_info()
-        if isinstance(exc, ConnectionError):
-            return
-        if (isinstance(exc, SSLError) and
-        exc.reason == "TLSV1_ALERT_UNKNOWN_CA"):
+        if quiet_error(exc):
             return
         if not isinstance(exc, Exception):
             self.close_request(request)
             raise  # Force server loop to exit
         super().handle_error(request, client_address)
 
+def quiet_error(exc):
+    """Whether a server should drop the exception without reporting it
+    
+    Covers clients disconnecting, and rejecting the server's certificate.
+    """
+    if isinstance(exc, ConnectionError):
+        return True
+    return (isinstance(exc, SSLError) and
+        exc.reason == "TLSV1_ALERT_UNKNOWN_CA")
+
 class PersistentConnectionHandler(urllib.request.BaseHandler):
     """URL handler for HTTP persistent connections
     
@@ -178,10 +323,30 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
         with opener.open("http://localhost/two") as response:
             response.read()
         
-        # Closes old connection when new host specified
+        # Opens second connection when new host specified
         with opener.open("http://example/three") as response:
             response.read()
-    # Socket freed at context manager exit
+        
+        # Connection to first host is still available
+        with opener.open("http://localhost/four") as response:
+            response.read()
+    # Sockets freed at context manager exit
+    
+    Connections are kept in a "ConnectionPool", which may be passed as
+    the "pool" keyword argument. The handler may be shared by several
+    threads; each thread uses its own connection.
+    
+    Passing pipeline=n allows up to n idempotent requests without bodies
+    to be sent on one connection through start_request() before their
+    responses are read. Each get_response() call returns the response to
+    the oldest outstanding request, and each response must be read before
+    the next is requested. If the server closes the connection, the
+    unanswered requests are sent again on a fresh connection.
+    
+    Passing accept_encoding=True sends "Accept-Encoding" with the codings
+    from "ACCEPT_ENCODING" (unless the request already has the header),
+    and default_open() then returns a "DecodedResponse" whenever the
+    server applied one of them.
     
     Currently does not reuse an existing connection if
     two host names happen to resolve to the same Internet address.
@@ -192,16 +357,32 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
         "https": http.client.HTTPSConnection,
     }
     
-    def __init__(self, *pos, **kw):
-        self._type = None
-        self._host = None
+    idempotents = {"GET", "HEAD", "PUT", "DELETE", "TRACE", "OPTIONS"}
+    
+    def __init__(self, *pos, pool=None, pipeline=0, accept_encoding=False,
+            **kw):
         self._pos = pos
         self._kw = kw
-        self._connection = None
+        if pool is None:
+            pool = ConnectionPool()
+        self.pool = pool
+        self.pipeline = pipeline
+        self.accept_encoding = accept_encoding
+        self._local = local()
+    
+    # Connection used by the current thread's request
+    @property
+    def _connection(self):
+        return getattr(self._local, "connection", None)
+    @_connection.setter
+    def _connection(self, connection):
+        self._local.connection = connection
     
     def default_open(self, req):
         if req.type not in self.conn_classes:
             return None
+        if self.accept_encoding and not req.has_header("Accept-encoding"):
+            req.add_unredirected_header("Accept-Encoding", ACCEPT_ENCODING)
         
         with self._setup_request(req):
             headers = dict(req.header_items())
@@ -211,12 +392,22 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
                 # (Re)try request on a fresh connection
                 self._attempt_request(req, headers)
                 response = self._connection.getresponse()
+            self.pool.release(self._connection, response)
         
         # Odd impedance mismatch between "http.client" and "urllib.request"
         response.msg = response.reason
+        # Responses to HEAD, and these statuses, have no body to decode
+        bodiless = (req.get_method() == "HEAD" or
+            response.status < 200 or response.status in {204, 304})
+        if self.accept_encoding and not bodiless:
+            decoder = content_decoder(response.headers)
+            if decoder is not None:
+                response = DecodedResponse(response, decoder)
         return response
     
     def start_request(self, request):
+        if self.pipeline:
+            return self._start_pipelined(request)
         with self._setup_request(request):
             self._check_reusable()
             self._connection.putrequest(
@@ -229,24 +420,84 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
         return DelegateWriter(self._connection.send)
     
     def get_response(self):
-        response = self._connection.getresponse()
+        if self.pipeline:
+            return self._get_pipelined()
+        try:
+            response = self._connection.getresponse()
+        except:
+            self.pool.discard(self._connection)
+            raise
+        response.msg.set_default_type(None)
+        self.pool.release(self._connection, response)
+        return response
+    
+    def _start_pipelined(self, request):
+        # Outstanding (pipeline, request) pairs, oldest first
+        pending = self._local.__dict__.setdefault("pending", deque())
+        # {key: pipeline accepting more requests}
+        pipelines = self._local.__dict__.setdefault("pipelines", dict())
+        
+        key = self._key(request)
+        pipeline = pipelines.get(key)
+        replayable = (request.get_method() in self.idempotents and
+            request.data is None)
+        if (not replayable or pipeline is None or
+                len(pipeline.requests) >= self.pipeline):
+            with self._setup_request(request):
+                self._check_reusable()
+            pipeline = _Pipeline(key, self._connection)
+            if replayable:
+                pipelines[key] = pipeline
+            else:
+                pipelines.pop(key, None)
+        self._connection = pipeline.connection
+        try:
+            pipeline.send(request)
+        except:
+            pipeline.requests.pop()
+            pipeline.connection.close()  # Replays any earlier requests
+            if not pipeline.requests:
+                self._end_pipeline(pipeline)
+            raise
+        pending.append((pipeline, request))
+    
+    def _get_pipelined(self):
+        [pipeline, request] = self._local.pending.popleft()
+        try:
+            response = pipeline.get_response(request, self.idempotents)
+        except:
+            pipeline.abandon()
+            if not pipeline.requests:
+                self._end_pipeline(pipeline)
+            raise
         response.msg.set_default_type(None)
+        if not pipeline.requests:
+            self._end_pipeline(pipeline, response)
         return response
     
+    def _end_pipeline(self, pipeline, response=None):
+        pipelines = self._local.pipelines
+        if pipelines.get(pipeline.key) is pipeline:
+            del pipelines[pipeline.key]
+        self.pool.release(pipeline.connection, response)
+    
+    def _key(self, req):
+        conn_class = self.conn_classes[req.type]
+        return (req.type,) + parse_addr(req.host, conn_class.default_port)
+    
     @contextmanager
     def _setup_request(self, req):
-        if req.type != self._type or req.host != self._host:
-            if self._connection:
-                self._connection.close()
-            conn_class = self.conn_classes[req.type]
+        conn_class = self.conn_classes[req.type]
+        key = self._key(req)
+        self._connection = self.pool.get(key)
+        if self._connection is None:
             self._connection = conn_class(req.host, *self._pos, **self._kw)
-            self._type = req.type
-            self._host = req.host
+            self.pool.add(key, self._connection)
         
         try:
             yield
         except:
-            self._connection.close()  # Allow caller to make more requests
+            self.pool.discard(self._connection)  # Closes the connection
             raise
     
     def _check_reusable(self):
@@ -271,9 +522,7 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
                     raise
                 raise http.client.BadStatusLine(err) from err
         except (ConnectionError, http.client.BadStatusLine):
-            idempotents = {
-                "GET", "HEAD", "PUT", "DELETE", "TRACE", "OPTIONS"}
-            if req.get_method() not in idempotents:
+            if req.get_method() not in self.idempotents:
                 raise
             self._connection.close()
             return None  # Retry requests whose method indicates idempotence
@@ -296,14 +545,236 @@ class PersistentConnectionHandler(urllib.request.BaseHandler):
                 raise
     
     def close(self):
-        if self._connection:
-            self._connection.close()
+        self.pool.close()
     
     def __enter__(self):
         return self
     def __exit__(self, *exc):
         self.close()
 
+class _Pipeline:
+    """Requests sent on one connection whose responses are not yet read"""
+    
+    def __init__(self, key, connection):
+        self.key = key
+        self.connection = connection
+        self.requests = deque()  # Oldest first
+        self.reader = None  # Shared by all responses on the connection
+        self.response = None
+        # Failure of a fresh connection is not retried
+        self.fresh = connection.sock is None
+    
+    def send(self, request):
+        self.requests.append(request)
+        self._send(request)
+    
+    def _send(self, request):
+        encoder = _RequestEncoder(self.connection)
+        encoder.request(request.get_method(), request.selector,
+            request.data, dict(request.header_items()))
+        try:
+            self.connection.send(b"".join(encoder.data))
+        except (ConnectionRefusedError, ConnectionAbortedError):
+            raise  # Assume connection was not established
+        except ConnectionError:
+            pass  # Replayed after reading any earlier responses
+    
+    def get_response(self, request, idempotents):
+        """Reads the response to the oldest request"""
+        
+        assert self.requests[0] is request
+        if self.response is not None and not self.response.isclosed():
+            raise http.client.ResponseNotReady("Previous response not read")
+        while True:
+            if self.connection.sock is None:  # Closed after an error
+                self._replay()
+            if self.reader is None:
+                self.reader = self.connection.sock.makefile("rb")
+            response = http.client.HTTPResponse(
+                _SharedReaderSocket(self.reader), method=request.get_method())
+            try:
+                try:
+                    response.begin()
+                except EnvironmentError as err:  # Python < 3.3 compat.
+                    if err.errno not in DISCONNECTION_ERRNOS:
+                        raise
+                    raise http.client.BadStatusLine(err) from err
+            except (ConnectionError, http.client.BadStatusLine):
+                if self.fresh or any(request.get_method() not in idempotents
+                        for request in self.requests):
+                    raise
+                self._replay()
+                continue
+            if response.status == http.client.REQUEST_TIMEOUT:
+                if not self.fresh:
+                    # Server indicated it did not handle request
+                    response.close()
+                    self._replay()
+                    continue
+            break
+        
+        self.requests.popleft()
+        self.fresh = False
+        self.response = response
+        return response
+    
+    def abandon(self):
+        """Drops the oldest request after an error"""
+        self.requests.popleft()
+        self.response = None
+        self.connection.close()
+        self.reader = None
+    
+    def _replay(self):
+        """Sends unanswered requests again on a fresh connection"""
+        self.connection.close()
+        self.reader = None
+        self.response = None
+        self.fresh = True
+        for request in self.requests:
+            self._send(request)
+
+class _RequestEncoder(http.client.HTTPConnection):
+    """Collects a request as "http.client" would send it
+    
+    This keeps its checks of the method, target and header fields, and its
+    encoding of "Host", without its one-request-at-a-time state."""
+    
+    def __init__(self, connection):
+        self.default_port = connection.default_port
+        http.client.HTTPConnection.__init__(self,
+            connection.host, connection.port)
+        self.data = list()
+    
+    def send(self, data):
+        self.data.append(data)
+
+class _SharedReaderSocket:
+    """Lets "http.client.HTTPResponse" read from a shared buffered reader"""
+    
+    def __init__(self, reader):
+        self.reader = reader
+    
+    def makefile(self, *pos, **kw):
+        return _UnclosedReader(self.reader)
+
+class _UnclosedReader:
+    def __init__(self, reader):
+        self._reader = reader
+    
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+    
+    def close(self):
+        pass  # Leave open for the next response
+
+class ConnectionPool:
+    """Thread-safe set of HTTP connections keyed by (scheme, host, port)
+    
+    A connection is idle once the response to its last request has been
+    closed. At most "max_idle_per_host" idle connections are kept for each
+    key, and "max_idle" in total; the least recently used connections are
+    closed first. Connections idle for longer than "idle_timeout" seconds
+    are also closed.
+    """
+    
+    def __init__(self, max_idle_per_host=4, max_idle=64, idle_timeout=60):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._lock = Lock()
+        # {connection: _PoolEntry}, least recently used first
+        self._entries = OrderedDict()
+        self._keys = dict()  # {key: [connection, . . .]}
+    
+    def get(self, key):
+        """Returns an idle connection, or None if there is none"""
+        with self._lock:
+            self._reap()
+            for connection in reversed(self._keys.get(key, ())):
+                entry = self._entries[connection]
+                if entry.idle():
+                    entry.response = _PoolEntry.BUSY
+                    self._entries.move_to_end(connection)
+                    return connection
+            return None
+    
+    def add(self, key, connection):
+        """Adds a new connection, which is not idle until released"""
+        with self._lock:
+            self._entries[connection] = _PoolEntry(key)
+            self._keys.setdefault(key, list()).append(connection)
+    
+    def release(self, connection, response=None):
+        """Connection becomes idle once the response is closed"""
+        with self._lock:
+            entry = self._entries.get(connection)
+            if entry is None:
+                return
+            if response is None:
+                entry.response = None
+            else:
+                entry.response = weakref.ref(response)
+            entry.time = monotonic()
+            self._reap()
+    
+    def discard(self, connection):
+        """Removes and closes a connection"""
+        with self._lock:
+            self._remove(connection)
+        connection.close()
+    
+    def close(self):
+        with self._lock:
+            connections = list(self._entries)
+            self._entries.clear()
+            self._keys.clear()
+        for connection in connections:
+            connection.close()
+    
+    def _reap(self):
+        expiry = monotonic() - self.idle_timeout
+        idle = 0
+        host_idle = dict()
+        # Count from the most recently used, so that the oldest connections
+        # are the ones over the limits
+        for [connection, entry] in reversed(tuple(self._entries.items())):
+            if not entry.idle():
+                continue
+            idle += 1
+            host_idle[entry.key] = host_idle.get(entry.key, 0) + 1
+            if (entry.time < expiry or idle > self.max_idle or
+                    host_idle[entry.key] > self.max_idle_per_host):
+                self._remove(connection)
+                connection.close()
+                idle -= 1
+                host_idle[entry.key] -= 1
+    
+    def _remove(self, connection):
+        entry = self._entries.pop(connection, None)
+        if entry is None:
+            return
+        connections = self._keys[entry.key]
+        connections.remove(connection)
+        if not connections:
+            del self._keys[entry.key]
+
+class _PoolEntry:
+    BUSY = object()
+    
+    def __init__(self, key):
+        self.key = key
+        self.response = self.BUSY  # Or None, or weak reference to response
+        self.time = monotonic()
+    
+    def idle(self):
+        if self.response is self.BUSY:
+            return False
+        if self.response is None:
+            return True
+        response = self.response()
+        return response is None or response.isclosed()
+
 def http_request(url, types=None, *,
         urlopen=urllib.request.urlopen, headers=(), **kw):
     headers = dict(headers)
@@ -321,3 +792,154 @@ def http_request(url, types=None, *,
     except:
         response.close()
         raise
+
+def _gzip():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _deflate():
+    # Servers differ over whether "deflate" includes the zlib header
+    return _DeflateDecompressor()
+
+# {coding: decompressor factory}
+DECOMPRESSORS = {"gzip": _gzip, "x-gzip": _gzip, "deflate": _deflate}
+if bz2 is not None:
+    DECOMPRESSORS["bzip2"] = bz2.BZ2Decompressor
+if lzma is not None:
+    DECOMPRESSORS["xz"] = lzma.LZMADecompressor
+ACCEPT_ENCODING = ", ".join(DECOMPRESSORS)
+
+class ContentDecoder:
+    """Incrementally decodes a body with a supported "Content-Encoding"
+    
+    Each decode() call produces at most "max_length" bytes, however much
+    the input expands, so that a small compressed body cannot inflate into
+    an arbitrary amount of memory. Compressed input not yet decoded is
+    held back until "needs_input" is true again. "empty" remains true
+    until some input is given.
+    """
+    
+    def __init__(self, coding):
+        self.decompressor = DECOMPRESSORS[coding.lower()]()
+        self.empty = True
+        # Only the "zlib" decompressors hand back unconsumed input
+        self.tail = hasattr(self.decompressor, "unconsumed_tail")
+    
+    @property
+    def needs_input(self):
+        if self.eof:
+            return True
+        if self.tail:
+            return not self.decompressor.unconsumed_tail
+        return self.decompressor.needs_input
+    
+    @property
+    def eof(self):
+        return self.decompressor.eof
+    
+    def decode(self, data, max_length):
+        """"max_length" must be positive"""
+        if self.eof:
+            if data:
+                raise ValueError("Data after end of compressed stream")
+            return b""
+        if data:
+            self.empty = False
+        if self.tail:
+            data = self.decompressor.unconsumed_tail + data
+        return self.decompressor.decompress(data, max_length)
+
+class _DeflateDecompressor:
+    """Accepts either zlib-wrapped or raw deflate data"""
+    
+    def __init__(self):
+        self._zlib = zlib.decompressobj()
+        self._data = b""
+        self._raw = None  # Not decided until the first data
+    
+    @property
+    def unconsumed_tail(self):
+        return self._zlib.unconsumed_tail
+    
+    @property
+    def eof(self):
+        return self._zlib.eof
+    
+    def decompress(self, data, max_length):
+        if self._raw is not None:
+            return self._zlib.decompress(data, max_length)
+        self._data += data
+        try:
+            result = self._zlib.decompress(self._data, max_length)
+        except zlib.error:
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._zlib.decompress(self._data, max_length)
+            self._raw = True
+        else:
+            if result or self._zlib.unconsumed_tail or self._zlib.eof:
+                self._raw = False
+            else:
+                # Too short to tell; try again with more data
+                self._zlib = zlib.decompressobj()
+                return result
+        self._data = None
+        return result
+
+def content_decoder(headers):
+    """Returns a "ContentDecoder" for a single supported content coding
+    
+    Otherwise returns None, and the body should be used as it is."""
+    
+    codings = (coding.strip() for coding in
+        header_list(headers, "Content-Encoding"))
+    codings = [coding for coding in codings
+        if coding and coding.lower() != "identity"]
+    if len(codings) != 1 or codings[0].lower() not in DECOMPRESSORS:
+        return None
+    return ContentDecoder(codings[0])
+
+class DecodedResponse(io.RawIOBase):
+    """Decodes the body of an "http.client" response as it is read
+    
+    Other attributes, such as "status" and "headers", are those of the
+    original response, whose "Content-Encoding" and "Content-Length" fields
+    describe the encoded body. Raises "EOFError" if the encoded body is
+    truncated, but a completely empty body is read as empty."""
+    
+    bufsize = 0x10000
+    
+    def __init__(self, response, decoder):
+        io.RawIOBase.__init__(self)
+        self.response = response
+        self.decoder = decoder
+        self._drained = False  # Encoded body all read
+    
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast("B") as view:
+            if not len(view):
+                return 0
+            while not self.decoder.eof:
+                data = b""
+                if self.decoder.needs_input and not self._drained:
+                    data = self.response.read1(self.bufsize)
+                    self._drained = not data
+                data = self.decoder.decode(data, len(view))
+                if data:
+                    view[:len(data)] = data
+                    return len(data)
+                if self._drained:
+                    if self.decoder.empty:
+                        return 0  # No body at all
+                    raise EOFError("Compressed response body is truncated")
+            return 0
+    
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            io.RawIOBase.close(self)
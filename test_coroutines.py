@@ -0,0 +1,1283 @@
+#! /usr/bin/env python3
+
+from unittest import TestCase
+import asyncio
+import struct
+import coroutines
+import tkinter
+from coroutines import http
+
+class MockSocket:
+    def __init__(self, data, *, loop, chunk=None):
+        self.loop = loop
+        self.data = data
+        self.chunk = chunk
+        self.recv_calls = 0
+        self.sent = list()
+    
+    async def recv(self, bufsize):
+        self.recv_calls += 1
+        await asyncio.sleep(0)
+        if self.chunk is not None:
+            bufsize = min(bufsize, self.chunk)
+        data = self.data[:bufsize]
+        self.data = self.data[bufsize:]
+        return data
+    
+    async def recv_into(self, buffer):
+        data = await self.recv(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    async def sendmsg(self, buffers):
+        self.sent.append(b"".join(buffers))
+    
+    async def sendall(self, data):
+        self.sent.append(bytes(data))
+    
+    def close(self):
+        pass
+
+class LoopTest(TestCase):
+    new_loop = staticmethod(asyncio.new_event_loop)
+    
+    def setUp(self):
+        TestCase.setUp(self)
+        self.loop = self.new_loop()
+        self.addCleanup(self.loop.close)
+    
+    def run_loop(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+class TestSocket(LoopTest):
+    def setUp(self):
+        import socket
+        from coroutines.socket import Socket
+        LoopTest.setUp(self)
+        [a, self.peer] = socket.socketpair()
+        self.addCleanup(self.peer.close)
+        self.sock = Socket(fileno=a.detach(), loop=self.loop)
+        self.addCleanup(self.sock.close)
+    
+    def test_sendall(self):
+        """Test data larger than the socket buffer is completely sent"""
+        from threading import Thread
+        data = bytes(range(256)) * 20000
+        received = bytearray()
+        def receive():
+            while len(received) < len(data):
+                received.extend(self.peer.recv(0x10000))
+        thread = Thread(target=receive)
+        thread.start()
+        self.run_loop(self.sock.sendall(data))
+        thread.join()
+        self.assertEqual(data, received)
+    
+    def test_recv_exactly(self):
+        buffer = bytearray(10)
+        self.peer.sendall(b"12345")
+        self.loop.call_soon(self.peer.sendall, b"67890extra")
+        self.run_loop(self.sock.recv_exactly(buffer))
+        self.assertEqual(b"1234567890", buffer)
+        self.peer.close()
+        with self.assertRaises(EOFError):
+            self.run_loop(self.sock.recv_exactly(bytearray(10)))
+
+    def test_close_waiting(self):
+        """Test cancelling a wait after the socket was closed"""
+        task = self.loop.create_task(self.sock.recv(10))
+        self.run_loop(asyncio.sleep(0.01))
+        self.sock.close()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_loop(task)
+
+class TestPersistentSocket(TestSocket):
+    """Test the file descriptor stays registered between waits"""
+    
+    def setUp(self):
+        import socket
+        from coroutines.socket import Socket
+        LoopTest.setUp(self)
+        [a, self.peer] = socket.socketpair()
+        self.addCleanup(self.peer.close)
+        self.sock = Socket(fileno=a.detach(), loop=self.loop, persistent=True)
+        self.addCleanup(self.sock.close)
+    
+    def test_cancel(self):
+        task = self.loop.create_task(self.sock.recv(10))
+        self.run_loop(asyncio.sleep(0.01))
+        self.assertTrue(self.sock._reading.registered)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_loop(task)
+        self.peer.sendall(b"data")
+        self.assertEqual(b"data", self.run_loop(self.sock.recv(10)))
+        self.sock.close()
+        self.assertFalse(self.sock._reading.registered)
+    
+    def test_cancel_second(self):
+        """Test cancelling only the second of two waiters"""
+        tasks = [self.loop.create_task(self.sock.recv(10))
+            for _ in range(2)]
+        self.run_loop(asyncio.sleep(0.01))
+        tasks[1].cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_loop(asyncio.wait_for(tasks[1], 1))
+        self.peer.sendall(b"data")
+        self.assertEqual(b"data",
+            self.run_loop(asyncio.wait_for(tasks[0], 1)))
+        self.peer.sendall(b"more")
+        self.assertEqual(b"more", self.run_loop(self.sock.recv(10)))
+
+class TestHttpRequest(LoopTest):
+    def test_single_write(self):
+        sock = MockSocket(b"", loop=self.loop)
+        conn = http.HTTPConnection(sock)
+        async def request():
+            await conn.putrequest("POST", "/path with\tcontrols\x7F")
+            await conn.putheader("Host", "localhost")
+            await conn.putheader("Content-Length", "4")
+            await conn.endheaders(b"body")
+        self.run_loop(request())
+        self.assertEqual([
+            b"POST /path%20with%09controls\x7F HTTP/1.1\r\n"
+            b"Host: localhost\r\n"
+            b"Content-Length: 4\r\n"
+            b"\r\n"
+            b"body"
+        ], sock.sent)
+
+class TestHttpResponse(LoopTest):
+    def getresponse(self, data, **kw):
+        sock = MockSocket(data, loop=self.loop, **kw)
+        conn = http.HTTPConnection(sock)
+        return (sock, self.run_loop(conn.getresponse()))
+    
+    def test_length(self):
+        for chunk in (None, 1, 7):
+            with self.subTest(chunk=chunk):
+                [sock, response] = self.getresponse(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Length: 6\r\n"
+                    b"X-Dummy: value\r\n"
+                    b"\r\n"
+                    b"body\r\n",
+                chunk=chunk)
+                self.assertEqual(200, response.status)
+                self.assertEqual("OK", response.reason)
+                self.assertEqual("value", response.msg["X-Dummy"])
+                body = bytearray()
+                while response.size:
+                    body.extend(self.run_loop(response.read(0x10000)))
+                self.assertEqual(b"body\r\n", body)
+                if chunk is None:
+                    self.assertEqual(1, sock.recv_calls,
+                        "Expected a single recv()")
+    
+    def test_chunked(self):
+        [_, response] = self.getresponse(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+            b"4\r\nbody\r\n"
+            b"2;ext=1\r\n\r\n\r\n"
+            b"0\r\n"
+            b"Trailer: value\r\n"
+            b"\r\n"
+        )
+        body = bytearray()
+        while True:
+            data = self.run_loop(response.read(0x10000))
+            if not data:
+                break
+            body.extend(data)
+        self.assertEqual(b"body\r\n", body)
+    
+    def test_decoded(self):
+        import zlib
+        body = zlib.compress(b"body\r\n" * 10000)
+        [_, response] = self.getresponse(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Content-Encoding: deflate\r\n"
+            b"\r\n" +
+            b"".join(b"%X\r\n%s\r\n" % (len(body[i:i + 10]), body[i:i + 10])
+                for i in range(0, len(body), 10)) +
+            b"0\r\n\r\n"
+        )
+        response = http.decode_response(response)
+        data = self.run_loop(response.read(100))
+        self.assertEqual(100, len(data))
+        data += self.run_loop(response.read())
+        self.assertEqual(b"body\r\n" * 10000, data)
+        self.assertTrue(response.complete.result())
+    
+    def test_chunked_bulk(self):
+        """Test reading several buffered chunks and the trailer at once"""
+        chunks = b"".join(b"2\r\n%02d\r\n" % i for i in range(100))
+        for chunk in (None, 5):
+            for readinto in (False, True):
+                with self.subTest(chunk=chunk, readinto=readinto):
+                    [_, response] = self.getresponse(
+                        b"HTTP/1.1 200 OK\r\n"
+                        b"Transfer-Encoding: chunked\r\n"
+                        b"\r\n" + chunks +
+                        b"0\r\n"
+                        b"Trailer: value\r\n"
+                        b"\r\n",
+                    chunk=chunk)
+                    body = bytearray()
+                    reads = 0
+                    while True:
+                        if readinto:
+                            buffer = bytearray(0x10000)
+                            size = self.run_loop(response.readinto(buffer))
+                            data = buffer[:size]
+                        else:
+                            data = self.run_loop(response.read(0x10000))
+                        if not data:
+                            break
+                        body.extend(data)
+                        reads += 1
+                    expected = "".join(format(i, "02") for i in range(100))
+                    self.assertEqual(expected.encode("ascii"), body)
+                    if chunk is None:
+                        self.assertEqual(1, reads, "Chunks not combined")
+                    self.assertEqual("value", response.trailers["Trailer"])
+                    self.assertIs(True, response.complete.result())
+    
+    def test_chunked_eof(self):
+        [_, response] = self.getresponse(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"\r\n"
+            b"10\r\nshort"
+        )
+        self.assertEqual(b"short", self.run_loop(response.read(0x10000)))
+        self.assertEqual(b"", self.run_loop(response.read(0x10000)))
+        self.assertIs(False, response.complete.result())
+    
+    def test_stream(self):
+        from coroutines.streams import streamcopy
+        from io import BytesIO
+        head = (b"HTTP/1.1 200 OK\r\n"
+            b"Content-Length: 10\r\n"
+            b"\r\n")
+        [_, response] = self.getresponse(head + b"0123456789", chunk=3)
+        response.high_water = 4
+        async def iterate():
+            return [chunk async for chunk in response]
+        chunks = self.run_loop(iterate())
+        self.assertEqual(b"0123456789", b"".join(chunks))
+        self.assertLessEqual(max(map(len, chunks)), 4)
+        
+        [_, response] = self.getresponse(head + b"0123456789", chunk=3)
+        self.assertEqual(b"01234", self.run_loop(response.readexactly(5)))
+        self.assertEqual(b"56789", self.run_loop(response.read()))
+        self.assertIs(True, response.complete.result())
+        
+        [_, response] = self.getresponse(head + b"01234")
+        with self.assertRaises(asyncio.IncompleteReadError):
+            self.run_loop(response.readexactly(10))
+        
+        [_, response] = self.getresponse(head + b"0123456789", chunk=3)
+        output = BytesIO()
+        copied = self.run_loop(streamcopy(response, output.write, bufsize=4))
+        self.assertEqual(10, copied)
+        self.assertEqual(b"0123456789", output.getvalue())
+    
+    def test_status_continuation(self):
+        [_, response] = self.getresponse(
+            b"HTTP/1.0 200 Long\r\n"
+            b" reason\r\n"
+            b"\r\n"
+        )
+        self.assertEqual("Long\r\n reason", response.reason)
+    
+    def test_interim(self):
+        [_, response] = self.getresponse(
+            b"HTTP/1.1 100 Continue\r\n"
+            b"\r\n"
+            b"HTTP/1.1 103 Early Hints\r\n"
+            b"Link: </style.css>; rel=preload\r\n"
+            b"\r\n"
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Length: 4\r\n"
+            b"\r\n"
+            b"body"
+        )
+        self.assertEqual(200, response.status)
+        self.assertEqual(b"body", self.run_loop(response.read()))
+    
+    def test_bad_status(self):
+        for line in (
+            b"HTTP/1.1\r\n",
+            b"ICY 200 OK\r\n",
+            b" " * 8 + b"HTTP/1.1 200 OK\r\n",
+            b"HTTP/1.1 20 OK\r\n",
+            b"HTTP/1" + b"1" * 9 + b" 200 OK\r\n",
+            b"",
+        ):
+            with self.subTest(line), self.assertRaises(http.BadStatusLine):
+                self.getresponse(line + b"\r\n")
+    
+    def test_excess(self):
+        with self.assertRaises(http.ExcessError):
+            self.getresponse(b"HTTP/1.1 200 " + b"x" * 400 + b"\r\n\r\n")
+        with self.assertRaises(http.ExcessError):
+            self.getresponse(b"HTTP/1.1 200 OK\r\n" + b"X: y\r\n" * 30000)
+        with self.assertRaises(http.ExcessError):
+            self.getresponse(b"HTTP/1.1 200 OK\r\n" +
+                b"X: " + b"y" * 60000 + b"\r\n" * 2)
+        with self.assertRaises(http.UnknownProtocol):
+            self.getresponse(b"HTTP/2.0 200 OK\r\n\r\n")
+
+class TestConnectionPool(LoopTest):
+    key = ("http", "localhost", 80)
+    
+    def setUp(self):
+        from coroutines.client import ConnectionPool
+        LoopTest.setUp(self)
+        self.pool = ConnectionPool(loop=self.loop, limit_per_host=1)
+        self.connected = list()
+        async def connect(key):
+            sock = MockSocket(b"HTTP/1.1 200 OK\r\n"
+                b"Content-Length: 0\r\n"
+                b"\r\n", loop=self.loop)
+            self.connected.append(sock)
+            return http.HTTPConnection(sock)
+        self.pool._connect = connect
+    
+    def test_cancel_woken(self):
+        """Test a waiter cancelled after being woken passes it on"""
+        self.run_loop(self.pool.acquire(self.key))
+        waiters = [self.loop.create_task(self.pool.acquire(self.key))
+            for _ in range(2)]
+        self.run_loop(asyncio.sleep(0))
+        self.pool._end(self.key)
+        waiters[0].cancel()
+        self.run_loop(asyncio.wait_for(waiters[1], 1))
+        self.assertTrue(waiters[0].cancelled())
+        self.assertEqual(1, self.pool._active[self.key])
+    
+    def test_retry(self):
+        """Test a request on a stale connection is retried on a new one"""
+        from coroutines.client import Session
+        stale = list()
+        class StaleSocket(MockSocket):
+            async def sendmsg(self, buffers):
+                stale.append(self)
+                raise ConnectionResetError()
+        self.pool._idle[self.key] = [
+            http.HTTPConnection(StaleSocket(b"", loop=self.loop))
+            for _ in range(2)]
+        self.pool._check_reusable = lambda connection: True
+        session = Session(loop=self.loop, pool=self.pool)
+        response = self.run_loop(session.request("GET", "http://localhost/"))
+        self.assertEqual(200, response.status)
+        self.assertEqual(1, len(stale), "Retried on idle connection")
+        self.assertEqual(1, len(self.connected))
+    
+    def test_ipv6_host(self):
+        from coroutines.client import Session
+        session = Session(loop=self.loop, pool=self.pool)
+        for [url, host] in (
+            ("http://[::1]/", b"[::1]"),
+            ("http://[::1]:8080/", b"[::1]:8080"),
+        ):
+            with self.subTest(url):
+                self.run_loop(session.request("GET", url))
+                [head] = self.connected.pop().sent
+                self.assertIn(b"\r\nHost: " + host + b"\r\n", head)
+
+class TestSession(LoopTest):
+    def setUp(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from threading import Thread
+        
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(handler):
+                body = handler.path.encode("ascii")
+                handler.send_response(200)
+                handler.send_header("Content-Length", format(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+            
+            def do_HEAD(handler):
+                handler.send_response(200)
+                handler.send_header("Content-Length", format(100))
+                handler.end_headers()
+            
+            self.handle_calls = 0
+            def handle(handler, *pos, **kw):
+                self.handle_calls += 1
+                return BaseHTTPRequestHandler.handle(handler, *pos, **kw)
+            
+            def log_message(handler, *pos, **kw):
+                pass
+        
+        server = ThreadingHTTPServer(("localhost", 0), RequestHandler)
+        self.addCleanup(server.server_close)
+        self.url = "http://localhost:{}".format(server.server_port)
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        LoopTest.setUp(self)
+    
+    def test_reuse(self):
+        from coroutines.client import Session
+        session = Session(loop=self.loop, limit_per_host=2)
+        self.addCleanup(session.close)
+        
+        async def fetch(path):
+            response = await session.request("GET", self.url + path)
+            body = bytearray()
+            while True:
+                data = await response.read(0x10000)
+                if not data:
+                    return body
+                body.extend(data)
+        async def fetch_all(paths):
+            return await asyncio.gather(*map(fetch, paths))
+        paths = ["/{}".format(i) for i in range(10)]
+        bodies = self.run_loop(fetch_all(paths))
+        self.assertEqual(paths, [body.decode("ascii") for body in bodies])
+        self.assertEqual(2, self.handle_calls, "Connections not reused")
+    
+    def test_head(self):
+        from coroutines.client import Session
+        session = Session(loop=self.loop)
+        self.addCleanup(session.close)
+        async def fetch(method):
+            response = await session.request(method, self.url + "/path")
+            return await asyncio.wait_for(response.read(), 5)
+        self.assertEqual(b"", self.run_loop(fetch("HEAD")))
+        self.assertEqual(b"/path", self.run_loop(fetch("GET")))
+        self.assertEqual(1, self.handle_calls, "Connection not reused")
+
+class TestServer(LoopTest):
+    def setUp(self):
+        from coroutines.server import Server
+        LoopTest.setUp(self)
+        self.server = Server(self.handle, loop=self.loop)
+        self.server.listen(("127.0.0.1", 0))
+        def close():
+            self.server.close()
+            self.run_loop(self.server.wait_closed())
+        self.addCleanup(close)
+    
+    async def handle(self, request, response):
+        if request.target == "/unread":
+            await response.end(b"unread")
+            return
+        body = await request.body.read()
+        if request.target == "/error":
+            raise ValueError("Handler failure")
+        if request.target == "/disconnect":
+            raise ConnectionResetError()
+        if request.target == "/split":
+            response.headers.append(("X-Split", "a\r\nSet-Cookie: b"))
+        if request.target == "/close":
+            response.headers.append(("Connection", "close"))
+        if request.target == "/empty":
+            await response.end()
+            return
+        if request.target == "/stream":
+            await response.write(b"first,")
+            await response.write(b"second")
+            return
+        await response.end(request.method.encode() + b" " +
+            request.target.encode() + b" " + body)
+    
+    def exchange(self, data):
+        async def exchange():
+            from coroutines.socket import Socket
+            with Socket(loop=self.loop) as sock:
+                await sock.connect(self.server.server_address)
+                await sock.sendall(data)
+                received = bytearray()
+                while True:
+                    chunk = await sock.recv(0x10000)
+                    if not chunk:
+                        return bytes(received)
+                    received.extend(chunk)
+        return self.run_loop(exchange())
+    
+    def test_pipeline(self):
+        received = self.exchange(
+            b"GET /one HTTP/1.1\r\n\r\n"
+            b"POST /two HTTP/1.1\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            b"4\r\nbody\r\n0\r\n\r\n"
+            b"GET /stream HTTP/1.1\r\n\r\n"
+            b"HEAD /four HTTP/1.1\r\n\r\n"
+            b"PUT /five HTTP/1.1\r\n"
+            b"Content-Length: 4\r\n"
+            b"Connection: close\r\n\r\n"
+            b"data"
+            b"GET /ignored HTTP/1.1\r\n\r\n"
+        )
+        self.assertEqual(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\n"
+            b"GET /one "
+            b"HTTP/1.1 200 OK\r\nContent-Length: 14\r\n\r\n"
+            b"POST /two body"
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"6\r\nfirst,\r\n6\r\nsecond\r\n0\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 11\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 14\r\n"
+            b"Connection: close\r\n\r\n"
+            b"PUT /five data",
+            received)
+    
+    def test_errors(self):
+        from unittest.mock import patch
+        from io import StringIO
+        with patch("sys.stderr", StringIO()) as stderr:
+            received = self.exchange(b"GET /disconnect HTTP/1.1\r\n\r\n")
+        self.assertEqual(b"", received)
+        self.assertEqual("", stderr.getvalue())
+        
+        with patch("sys.stderr", StringIO()) as stderr:
+            received = self.exchange(b"GET /error HTTP/1.1\r\n\r\n")
+        self.assertTrue(received.startswith(b"HTTP/1.1 500 "))
+        self.assertIn("Handler failure", stderr.getvalue())
+        
+        received = self.exchange(b"BAD REQUEST\r\n\r\n")
+        self.assertTrue(received.startswith(b"HTTP/1.1 400 "))
+        
+        for length in (b"-1", b"+5", b"1_0", b" "):
+            with self.subTest(length):
+                received = self.exchange(
+                    b"POST /a HTTP/1.1\r\n"
+                    b"Content-Length: " + length + b"\r\n\r\n"
+                    b"GET /smuggled HTTP/1.1\r\n\r\n")
+                self.assertTrue(received.startswith(b"HTTP/1.1 400 "))
+                self.assertNotIn(b"smuggled", received)
+        
+        with patch("sys.stderr", StringIO()) as stderr:
+            received = self.exchange(b"GET /split HTTP/1.1\r\n\r\n")
+        self.assertTrue(received.startswith(b"HTTP/1.1 500 "))
+        self.assertNotIn(b"Set-Cookie", received)
+        self.assertIn("Invalid header value", stderr.getvalue())
+    
+    def test_empty(self):
+        received = self.exchange(
+            b"HEAD /empty HTTP/1.1\r\n\r\n"
+            b"GET /empty HTTP/1.1\r\n"
+            b"Connection: close\r\n\r\n")
+        self.assertEqual(
+            b"HTTP/1.1 200 OK\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n"
+            b"Connection: close\r\n\r\n",
+            received)
+    
+    def test_continue(self):
+        async def exchange(target, head=b""):
+            from coroutines.socket import Socket
+            with Socket(loop=self.loop) as sock:
+                await sock.connect(self.server.server_address)
+                await sock.sendall(b"POST " + target + b" HTTP/1.1\r\n"
+                    b"Expect: 100-continue\r\n"
+                    b"Content-Length: 4\r\n" + head + b"\r\n")
+                received = bytearray()
+                while True:
+                    chunk = await sock.recv(0x10000)
+                    if not chunk:
+                        return bytes(received)
+                    received.extend(chunk)
+                    if received == b"HTTP/1.1 100 Continue\r\n\r\n":
+                        await sock.sendall(b"data")
+        received = self.run_loop(asyncio.wait_for(exchange(b"/a",
+            b"Connection: close\r\n"), 5))
+        self.assertTrue(received.startswith(
+            b"HTTP/1.1 100 Continue\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(received.endswith(b"POST /a data"))
+        
+        received = self.run_loop(asyncio.wait_for(exchange(b"/unread"), 5))
+        self.assertEqual(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\nunread",
+            received)
+    
+    def test_close(self):
+        received = self.exchange(b"GET /close HTTP/1.1\r\n\r\n")
+        self.assertEqual(1, received.count(b"\r\nConnection: close\r\n"))
+    
+    def test_session(self):
+        from coroutines.client import Session
+        session = Session(loop=self.loop)
+        self.addCleanup(session.close)
+        url = "http://{}:{}".format(*self.server.server_address)
+        async def fetch(path):
+            response = await session.request("GET", url + path)
+            return await response.read()
+        for path in ("/a", "/b"):
+            body = self.run_loop(fetch(path))
+            self.assertEqual("GET {} ".format(path).encode(), body)
+        self.assertEqual(1, len(self.server._connections),
+            "Connection not kept alive")
+
+class DnsStub:
+    """Local UDP DNS server answering queries from dictionaries"""
+    
+    def __init__(self, records):
+        import socket
+        from threading import Thread
+        self.records = records  # {name: (address or addresses, ttl)}
+        self.rdata = dict()  # {(name, type): [data, . . .]}
+        self.queries = list()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.thread = Thread(target=self.serve)
+        self.thread.start()
+    
+    def serve(self):
+        import struct
+        import socket
+        while True:
+            [query, address] = self.sock.recvfrom(512)
+            if not query:
+                break
+            [id] = struct.unpack_from("!H", query)
+            end = query.index(b"\0", 12) + 1
+            labels = list()
+            pos = 12
+            while query[pos]:
+                labels.append(query[pos + 1:pos + 1 + query[pos]])
+                pos += 1 + query[pos]
+            name = b".".join(labels).decode("ascii")
+            [qtype] = struct.unpack_from("!H", query, end)
+            self.queries.append((name, qtype))
+            question = query[12:end + 4]
+            record = self.records.get(name)
+            rdata = self.rdata.get((name, qtype), ())
+            flags = 0x8180
+            ttl = 100
+            if record is not None:
+                [addresses, ttl] = record
+                if isinstance(addresses, str):
+                    addresses = (addresses,)
+                if qtype == 1:
+                    rdata = [socket.inet_aton(address)
+                        for address in addresses]
+            elif not rdata:
+                flags = 0x8183  # NXDOMAIN
+            answers = b"".join(b"\xC0\x0C" +
+                struct.pack("!HHIH", qtype, 1, ttl, len(data)) + data
+                for data in rdata)
+            header = struct.pack("!HHHHHH", id, flags, 1, len(rdata), 0, 0)
+            self.sock.sendto(header + question + answers, address)
+    
+    def close(self):
+        self.sock.sendto(b"", self.address)
+        self.thread.join()
+        self.sock.close()
+
+class TestResolver(LoopTest):
+    def setUp(self):
+        from coroutines.cares import Resolver
+        import cares
+        LoopTest.setUp(self)
+        cares.snapshot.clear()
+        self.addCleanup(cares.snapshot.clear)
+        self.stub = DnsStub({"cached.test": ("192.0.2.1", 100)})
+        self.addCleanup(self.stub.close)
+        self.resolver = Resolver(loop=self.loop, servers=(self.stub.address,))
+        self.addCleanup(self.resolver.close)
+    
+    def resolve(self, name):
+        from socket import AF_INET
+        return self.run_loop(self.resolver.resolve(name, AF_INET))
+    
+    def test_cache(self):
+        self.assertEqual(["192.0.2.1"], self.resolve("cached.test").addr_list)
+        queries = len(self.stub.queries)
+        self.assertEqual(["192.0.2.1"], self.resolve("cached.test").addr_list)
+        self.assertEqual(queries, len(self.stub.queries), "Not cached")
+        
+        time = self.loop.time
+        self.loop.time = lambda: time() + 101
+        self.assertEqual(["192.0.2.1"], self.resolve("cached.test").addr_list)
+        self.assertGreater(len(self.stub.queries), queries, "Not expired")
+    
+    def test_negative(self):
+        with self.assertRaises(EnvironmentError):
+            self.resolve("missing.test")
+        queries = len(self.stub.queries)
+        with self.assertRaises(EnvironmentError):
+            self.resolve("missing.test")
+        self.assertEqual(queries, len(self.stub.queries), "Not cached")
+    
+    def test_concurrent(self):
+        async def resolve_all():
+            from socket import AF_INET
+            names = ["cached.test"] * 10
+            return await asyncio.gather(*(self.resolver.resolve(name, AF_INET)
+                for name in names))
+        results = self.run_loop(resolve_all())
+        self.assertEqual(10, len(results))
+        self.assertEqual([("cached.test", 1)], self.stub.queries)
+    
+    def test_close(self):
+        """Test closing cancels queries to an unresponsive server"""
+        from coroutines.cares import Resolver
+        import cares
+        import socket
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(("127.0.0.1", 0))
+            resolver = Resolver(loop=self.loop,
+                servers=(server.getsockname(),))
+            channel = resolver.channel
+            async def resolve_many():
+                names = ("a.test", "b.test")
+                return [result async for [_, result]
+                    in resolver.resolve_many(names, socket.AF_INET)]
+            task = self.loop.create_task(resolve_many())
+            self.run_loop(asyncio.sleep(0.01))
+            resolver.close()
+            results = self.run_loop(asyncio.wait_for(task, 1))
+        self.assertEqual([cares.ECANCELLED] * 2,
+            [error.errno for error in results])
+        self.assertFalse(channel.channel, "Channel not destroyed")
+        channel.destroy()
+    
+    def test_many(self):
+        from socket import AF_INET
+        names = ["host{}.test".format(i) for i in range(20)]
+        for [i, name] in enumerate(names):
+            self.stub.records[name] = ("192.0.2.{}".format(i), 100)
+        names.append("missing.test")
+        names.append("host1.test")
+        self.resolve("host0.test")
+        
+        async def resolve_all():
+            results = dict()
+            async for [name, result] in self.resolver.resolve_many(names,
+                    AF_INET, limit=3):
+                results.setdefault(name, list()).append(result)
+            return results
+        async def concurrent():
+            resolve = self.resolver.resolve("host19.test", AF_INET)
+            return await asyncio.gather(resolve_all(), resolve)
+        [results, hostent] = self.run_loop(concurrent())
+        self.assertEqual(set(names), results.keys())
+        self.assertEqual(2, len(results["host1.test"]))
+        results = {name: result for [name, [result, *_]] in results.items()}
+        for i in range(20):
+            addr_list = results["host{}.test".format(i)].addr_list
+            self.assertEqual(["192.0.2.{}".format(i)], addr_list)
+        self.assertIsInstance(results["missing.test"], EnvironmentError)
+        self.assertEqual(1, self.stub.queries.count(("host0.test", 1)),
+            "Cache not used")
+        self.assertEqual(["192.0.2.19"], hostent.addr_list)
+        self.assertEqual(1, self.stub.queries.count(("host19.test", 1)),
+            "Query not shared")
+    
+    def test_snapshot(self):
+        import cares
+        from coroutines.cares import Resolver
+        from tempfile import TemporaryDirectory
+        import os
+        from socket import AF_INET
+        from unittest.mock import patch
+        self.resolve("cached.test")
+        self.assertEqual({}, cares.snapshot, "Recorded without a file")
+        with TemporaryDirectory() as dir:
+            path = os.path.join(dir, "snapshot")
+            with patch("cares.snapshot_file", path), \
+                    patch("cares.snapshot_size", 1):
+                self.stub.records["other.test"] = ("192.0.2.2", 100)
+                self.resolve("other.test")
+                self.resolver._cache.clear()
+                self.resolve("cached.test")
+                self.assertEqual([("cached.test", AF_INET)],
+                    list(cares.snapshot), "Snapshot not bounded")
+            cares.save_snapshot(path)
+            cares.snapshot.clear()
+            cares.load_snapshot(path)
+            
+            resolver = Resolver(loop=self.loop, servers=(self.stub.address,))
+            self.addCleanup(resolver.close)
+            queries = len(self.stub.queries)
+            hostent = self.run_loop(resolver.resolve("cached.test", AF_INET))
+            self.assertEqual(["192.0.2.1"], hostent.addr_list)
+            self.assertEqual(queries, len(self.stub.queries),
+                "Snapshot not used")
+            
+            with open(path, "r+b") as file:
+                file.truncate(os.path.getsize(path) - 1)
+            cares.snapshot.clear()
+            cares.load_snapshot(path)
+            self.assertEqual({}, cares.snapshot, "Corrupt file loaded")
+            
+            os.remove(path)
+            os.mkdir(path)  # Cannot be replaced by a file
+            with self.assertRaises(EnvironmentError):
+                cares.save_snapshot(path)
+            self.assertEqual(["snapshot"], os.listdir(dir),
+                "Temporary file left behind")
+            with patch("cares.snapshot_file", path):
+                cares._save_at_exit()
+            
+            with patch("cares.snapshot_file"), \
+                    patch("cares._save_registered", False), \
+                    patch("atexit.register") as register:
+                cares.library_init(os.path.join(dir, "first"))
+                cares.library_init(os.path.join(dir, "second"))
+                register.assert_called_once_with(cares._save_at_exit)
+                self.assertEqual(os.path.join(dir, "second"),
+                    cares.snapshot_file)
+
+class TestQuery(LoopTest):
+    def setUp(self):
+        from coroutines.cares import Resolver
+        LoopTest.setUp(self)
+        self.stub = DnsStub(dict())
+        self.addCleanup(self.stub.close)
+        self.resolver = Resolver(loop=self.loop, servers=(self.stub.address,))
+        self.addCleanup(self.resolver.close)
+    
+    def test_srv(self):
+        import cares
+        self.stub.rdata[("_http._tcp.test", cares.T_SRV)] = [
+            struct.pack("!HHH", 10, 5, 8080) + b"\x03web\x04test\x00"]
+        records = self.run_loop(self.resolver.query("_http._tcp.test",
+            cares.T_SRV))
+        self.assertEqual([(10, 5, 8080, "web.test")], records)
+    
+    def test_txt(self):
+        import cares
+        self.stub.rdata[("text.test", cares.T_TXT)] = [b"\x05hello"]
+        records = self.run_loop(self.resolver.query("text.test",
+            cares.T_TXT))
+        self.assertEqual([b"hello"], records)
+    
+    def test_ptr(self):
+        import cares
+        self.stub.rdata[("1.2.0.192.in-addr.arpa", cares.T_PTR)] = [
+            b"\x04host\x04test\x00"]
+        [node, service] = self.run_loop(
+            self.resolver.getnameinfo(("192.0.2.1", 0)))
+        self.assertEqual("host.test", node)
+        self.assertIsNone(service)
+    
+    def test_missing(self):
+        import cares
+        with self.assertRaises(EnvironmentError):
+            self.run_loop(self.resolver.query("missing.test", cares.T_SRV))
+
+class TestHostEnt(TestCase):
+    """Test decoding "hostent" structures from c-ares"""
+    
+    def hostent(self, family, addresses, contiguous):
+        from ctypes import (
+            create_string_buffer, addressof, cast, pointer, POINTER, c_char,
+            c_char_p)
+        import cares
+        [length] = {len(address) for address in addresses}
+        block = create_string_buffer(b"".join(addresses))
+        offsets = range(0, len(addresses) * length, length)
+        pointers = [cast(addressof(block) + offset, POINTER(c_char))
+            for offset in offsets]
+        if not contiguous:
+            # Reversed, so not in the order of a contiguous array
+            block = create_string_buffer(b"".join(reversed(addresses)))
+            pointers = [cast(addressof(block) + offset, POINTER(c_char))
+                for offset in reversed(offsets)]
+        addr_list = (POINTER(c_char) * (len(pointers) + 1))(*pointers)
+        aliases = (c_char_p * 3)(b"alias1", b"alias2")
+        hostent = cares.HostEntC(h_name=b"host.test", h_aliases=aliases,
+            h_addrtype=family, h_length=length, h_addr_list=addr_list)
+        self.keep = (block, addr_list, aliases)  # Referenced by "hostent"
+        return pointer(hostent)
+    
+    def test_forms(self):
+        from socket import AF_INET, AF_INET6, inet_pton
+        from ipaddress import ip_address
+        from unittest.mock import patch
+        import cares
+        for [family, text] in (
+            (AF_INET, ["192.0.2.1", "192.0.2.2", "192.0.2.3"]),
+            (AF_INET6, ["2001:db8::1", "2001:db8::2"]),
+        ):
+            packed = [inet_pton(family, address) for address in text]
+            for [form, expected] in (
+                ("text", text),
+                ("packed", packed),
+                ("ip", list(map(ip_address, text))),
+            ):
+                for contiguous in (True, False):
+                    with self.subTest(family=family, form=form,
+                            contiguous=contiguous), \
+                            patch("cares.string_at",
+                                wraps=cares.string_at) as string_at:
+                        hostent = self.hostent(family, packed, contiguous)
+                        results = list()
+                        trampoline = cares.HostCallback()
+                        arg = trampoline.arm((cares.ADDRESS_FORMS[form],
+                            lambda *result: results.append(result)))
+                        trampoline.proxy(arg.value, cares.SUCCESS, 0,
+                            hostent)
+                        [[status, _, result]] = results
+                        self.assertEqual(cares.SUCCESS, status)
+                        self.assertEqual(expected, result.addr_list)
+                        self.assertEqual(b"host.test", result.name)
+                        self.assertEqual([b"alias1", b"alias2"],
+                            result.aliases)
+                        self.assertEqual(family, result.addrtype)
+                        calls = 1 if contiguous else len(packed)
+                        self.assertEqual(calls, string_at.call_count)
+    
+    def test_empty(self):
+        from ctypes import POINTER, c_char
+        import cares
+        addr_list = (POINTER(c_char) * 1)()
+        self.assertEqual([], cares.packed_addresses(addr_list, 4))
+        hostent = cares.HostEntC(h_aliases=None)
+        self.assertEqual([], cares.hostent_aliases(hostent))
+
+class TestHappyEyeballs(LoopTest):
+    def test_blackhole(self):
+        """Test a later address connects while the first is stalled"""
+        from coroutines.cares import Resolver, name_connect
+        import cares
+        self.addCleanup(cares.snapshot.clear)
+        stub = DnsStub({"he.test": (("192.0.2.1", "192.0.2.2"), 100)})
+        self.addCleanup(stub.close)
+        resolver = Resolver(loop=self.loop, servers=(stub.address,))
+        self.addCleanup(resolver.close)
+        Resolver._loops[self.loop] = resolver
+        
+        loop = self.loop
+        closed = list()
+        class Socket:
+            def __init__(self, family):
+                self.family = family
+            async def connect(self, address):
+                self.address = address
+                if address[0] == "192.0.2.1":
+                    await loop.create_future()  # Never connects
+            def close(self):
+                closed.append(self.address)
+        
+        messages = list()
+        sock = self.run_loop(name_connect(self.loop, ("he.test", 80), Socket,
+            message=messages.append, happy_eyeballs=True, delay=0.01))
+        self.assertEqual(("192.0.2.2", 80), sock.address)
+        self.run_loop(asyncio.sleep(0))
+        self.assertEqual([("192.0.2.1", 80)], closed, "Loser not closed")
+        self.assertTrue(any(message.startswith("Connected to 192.0.2.2:80")
+            for message in messages))
+    
+    def test_old_callback(self):
+        """Test a callback without attempted()"""
+        from coroutines.cares import _attempt
+        from socket import AF_INET
+        class Socket:
+            def __init__(self, family):
+                pass
+            async def connect(self, address):
+                pass
+        class Callback:
+            def connecting(self, address):
+                pass
+        self.run_loop(_attempt(self.loop, Socket, AF_INET,
+            ("192.0.2.1", 80), Callback()))
+
+from coroutines.selector import EventLoop as SelectorLoop
+
+class TestSelectorSocket(TestSocket):
+    new_loop = SelectorLoop
+
+class TestSelectorPersistentSocket(TestPersistentSocket):
+    new_loop = SelectorLoop
+
+class TestSelectorSession(TestSession):
+    new_loop = SelectorLoop
+
+class TestSelectorServer(TestServer):
+    new_loop = SelectorLoop
+
+class TestSelectorResolver(TestResolver):
+    new_loop = SelectorLoop
+
+class ManualLoop(coroutines.EventLoop):
+    """Event loop whose callbacks are invoked explicitly by the test"""
+    
+    def __init__(self):
+        coroutines.EventLoop.__init__(self)
+        self.scheduled = 0
+        self.readers = dict()
+        self.timers = list()
+        self.now = 0
+    
+    def new_callbacks(self):
+        self.scheduled += 1
+    
+    def set_timer(self, when):
+        self.timers.append(when)
+    
+    def time(self):
+        return self.now
+    
+    def add_reader(self, fd, callback, *args):
+        self.readers[fd] = (callback, args)
+    
+    def remove_reader(self, fd):
+        del self.readers[fd]
+
+class TestEventLoop(TestCase):
+    def setUp(self):
+        self.loop = ManualLoop()
+        self.addCleanup(self.loop.close)
+        self.calls = list()
+    
+    def test_cancel(self):
+        self.loop.call_soon(self.calls.append, 1)
+        self.loop.call_soon(self.calls.append, 2).cancel()
+        self.loop.call_soon(self.calls.append, 3)
+        self.assertEqual(1, self.loop.scheduled)
+        self.loop.invoke_callbacks()
+        self.assertEqual([1, 3], self.calls)
+    
+    def test_exception(self):
+        errors = list()
+        self.loop.set_exception_handler(
+            lambda loop, context: errors.append(context["exception"]))
+        def fail():
+            raise ValueError()
+        self.loop.call_soon(fail)
+        self.loop.call_soon(self.calls.append, "after")
+        self.loop.invoke_callbacks()
+        self.assertEqual(["after"], self.calls)
+        self.assertEqual(1, len(errors))
+    
+    def test_budget(self):
+        self.loop.budget = 2
+        for i in range(3):
+            self.loop.call_soon(self.calls.append, i)
+        self.loop.invoke_callbacks()
+        self.assertEqual([0, 1], self.calls)
+        self.assertEqual(2, self.loop.scheduled, "Remainder not scheduled")
+        self.loop.invoke_callbacks()
+        self.assertEqual([0, 1, 2], self.calls)
+    
+    def test_threadsafe(self):
+        from threading import Thread
+        from select import select
+        self.loop.call_soon(self.calls.append, "registered")
+        self.loop.invoke_callbacks()
+        self.assertEqual({}, self.loop.readers, "Wakeup not created lazily")
+        thread = Thread(target=self.loop.call_soon_threadsafe,
+            args=(self.calls.append, "thread"))
+        thread.start()
+        thread.join()
+        [fd] = self.loop.readers
+        self.assertEqual([fd], select((fd,), (), (), 0)[0], "No wakeup")
+        [callback, args] = self.loop.readers[fd]
+        callback(*args)
+        self.loop.invoke_callbacks()
+        self.assertEqual(["registered", "thread"], self.calls)
+
+    def test_timers(self):
+        self.loop.call_later(3, self.calls.append, 3)
+        self.loop.call_later(1, self.calls.append, 1)
+        self.loop.call_later(2, self.calls.append, 2).cancel()
+        self.loop.call_later(4, self.calls.append, 4)
+        self.assertEqual([3, 1], self.loop.timers, "Only earliest timer set")
+        
+        self.loop.now = 3
+        self.loop.expire_timers()
+        self.loop.invoke_callbacks()
+        self.assertEqual([1, 3], self.calls)
+        self.assertEqual(4, self.loop.timers[-1])
+        self.assertEqual(1, len(self.loop._timers), "Cancelled timer kept")
+
+class TestThread(TestCase):
+    def test_nested(self):
+        from coroutines import Thread, Callback
+        events = list()
+        def sub(depth):
+            if depth:
+                return (yield sub(depth - 1)) + 1
+            event = Callback()
+            events.append(event)
+            [value] = yield event
+            return value
+        thread = Thread(sub(10), join=True)
+        events.pop()(5)
+        self.assertEqual(15, thread.result.result())
+    
+    def test_exception(self):
+        from coroutines import Thread, Callback
+        def fail():
+            yield Callback()
+            raise ValueError()
+        def main():
+            try:
+                yield fail()
+            except ValueError:
+                return "caught"
+        thread = Thread(main(), join=True)
+        thread.event()
+        self.assertEqual("caught", thread.result.result())
+
+class TkStub:
+    """Widget recording the Tk calls made by "coroutines.tk.EventLoop"
+    
+    Scheduled functions are only run by the test."""
+    
+    def __init__(self, filehandlers=True):
+        self.calls = list()
+        self.idle = list()
+        self.handlers = dict()  # {fd: handler}
+        # Tcl on Windows has no file handlers
+        self.tk = self if filehandlers else object()
+    
+    def createfilehandler(self, fd, mask, handler):
+        self.calls.append(("createfilehandler", fd, mask))
+        self.handlers[fd] = handler
+    
+    def deletefilehandler(self, fd):
+        self.calls.append(("deletefilehandler", fd))
+        del self.handlers[fd]
+    
+    def after(self, ms, func, *args):
+        self.calls.append(("after", ms))
+        self.idle.append((func, args))
+        return "after#{}".format(len(self.calls))
+    
+    def after_idle(self, func, *args):
+        self.idle.append((func, args))
+    
+    def after_cancel(self, id):
+        self.calls.append(("after_cancel", id))
+    
+    def run_idle(self):
+        [idle, self.idle] = (self.idle, list())
+        for [func, args] in idle:
+            func(*args)
+
+class TestTkWakeup(TestCase):
+    def setUp(self):
+        from coroutines.tk import EventLoop
+        self.EventLoop = EventLoop
+        self.calls = list()
+    
+    def call_from_thread(self, loop):
+        from threading import Thread
+        thread = Thread(target=loop.call_soon_threadsafe,
+            args=(self.calls.append, "thread"))
+        thread.start()
+        thread.join()
+    
+    def test_filehandler(self):
+        widget = TkStub()
+        loop = self.EventLoop(widget)
+        self.addCleanup(loop.close)
+        loop.call_soon(self.calls.append, "soon")
+        widget.run_idle()
+        self.assertEqual([], widget.calls, "Wakeup not created lazily")
+        
+        self.call_from_thread(loop)
+        self.assertEqual([], widget.calls, "Tcl called from other thread")
+        widget.run_idle()  # Registers the wakeup from the Tcl thread
+        [[call, fd, _]] = widget.calls
+        self.assertEqual("createfilehandler", call)
+        widget.handlers[fd](fd, tkinter.READABLE)
+        widget.run_idle()
+        self.assertEqual(["soon", "thread"], self.calls)
+    
+    def test_poll(self):
+        """Test polling where Tk has no file handlers"""
+        widget = TkStub(filehandlers=False)
+        loop = self.EventLoop(widget)
+        self.call_from_thread(loop)
+        widget.run_idle()  # Starts polling, which finds the callback
+        self.assertEqual([("after", loop.wakeup_poll)], widget.calls)
+        widget.run_idle()  # Runs the callback and polls again
+        self.assertEqual(["thread"], self.calls)
+        self.assertEqual(("after", loop.wakeup_poll), widget.calls[-1])
+        loop.close()
+        self.assertEqual(("after_cancel", "after#2"), widget.calls[-1])
+
+class TestTkFilehandler(TestCase):
+    def setUp(self):
+        from coroutines.tk import EventLoop
+        self.widget = TkStub()
+        self.loop = EventLoop(self.widget)
+        self.addCleanup(self.loop.close)
+        self.calls = list()
+        self.fd = 3  # Not used as a real file
+    
+    def test_mask(self):
+        self.loop.add_reader(self.fd, self.calls.append, "read")
+        both = tkinter.READABLE | tkinter.WRITABLE
+        del self.widget.calls[:]
+        self.loop.add_writer(self.fd, self.calls.append, "write")
+        self.assertEqual([("createfilehandler", self.fd, both)],
+            self.widget.calls, "Mask not widened with one call")
+        
+        del self.widget.calls[:]
+        self.loop.remove_writer(self.fd)
+        self.assertEqual([], self.widget.calls)
+        self.widget.handlers[self.fd](self.fd, both)
+        self.assertEqual(["read"], self.calls)
+        self.assertEqual(
+            [("createfilehandler", self.fd, tkinter.READABLE)],
+            self.widget.calls, "Mask not narrowed by next event")
+        
+        del self.widget.calls[:]
+        self.widget.handlers[self.fd](self.fd, tkinter.READABLE)
+        self.assertEqual([], self.widget.calls)
+        self.loop.remove_reader(self.fd)
+        self.assertEqual([("deletefilehandler", self.fd)], self.widget.calls)
+        self.assertEqual({}, self.widget.handlers)
+
+class TestOffload(TestCase):
+    def setUp(self):
+        from concurrent.futures import ThreadPoolExecutor
+        self.loop = SelectorLoop()
+        self.addCleanup(self.loop.close)
+        self.executor = ThreadPoolExecutor(1)
+        self.addCleanup(self.executor.shutdown)
+    
+    def run_thread(self, routine):
+        from coroutines import Thread
+        done = self.loop.create_future()
+        thread = Thread(routine, join=True)
+        thread.reapers.append(lambda: done.set_result(None))
+        self.loop.run_until_complete(done)
+        return thread.result
+    
+    def test_thread(self):
+        from coroutines import Offload
+        def routine():
+            return (yield Offload(self.loop, self.executor, sum, (1, 2)))
+        self.assertEqual(3, self.run_thread(routine()).result())
+    
+    def test_traceback(self):
+        from coroutines import Offload
+        from traceback import extract_tb
+        def routine():
+            yield Offload(self.loop, self.executor, int, "x")
+        result = self.run_thread(routine())
+        self.assertIsInstance(result.exception(), ValueError)
+        names = [frame.name for frame in extract_tb(result.traceback)]
+        self.assertIn("run", names, "Worker frames missing")
+    
+    def test_await(self):
+        from coroutines import Offload
+        async def task():
+            return await Offload(self.loop, self.executor, sum, (1, 2))
+        self.assertEqual(3, self.loop.run_until_complete(task()))
+
+if __name__ == "__main__":
+    import unittest
+    unittest.main()
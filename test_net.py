@@ -172,6 +172,276 @@ class TestHttpSocket(TestMockHttp):
         sock2 = self.handler._connection.sock
         self.assertIsNot(sock1, sock2, "Expected new socket connection")
         self.assertTrue(sock2.reader, "Disconnected after second request")
+        
+        with self.urlopen("mock://localhost/three") as response:
+            self.assertEqual(b"Second body\r\n", response.read())
+        self.assertIs(sock1, self.handler._connection.sock,
+            "First connection not reused")
+    
+    def test_busy(self):
+        """Test new connection when existing response not closed"""
+        response1 = self.urlopen("mock://localhost/one")
+        self.addCleanup(response1.close)
+        sock1 = self.handler._connection.sock
+        with self.urlopen("mock://localhost/two") as response:
+            self.assertEqual(b"First body\r\n", response.read())
+        self.assertIsNot(sock1, self.handler._connection.sock,
+            "Expected new socket connection")
+
+class TestContentDecoder(TestCase):
+    def test_bound(self):
+        import zlib, gzip, bz2, lzma
+        body = bytes(1000000)
+        deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        encoded = {
+            "gzip": gzip.compress(body),
+            "deflate": zlib.compress(body),
+            "bzip2": bz2.compress(body),
+            "xz": lzma.compress(body),
+        }
+        encoded["raw deflate"] = deflate.compress(body) + deflate.flush()
+        for [coding, data] in encoded.items():
+            with self.subTest(coding):
+                decoder = net.ContentDecoder(coding.split()[-1])
+                output = bytearray()
+                while not decoder.eof:
+                    input = data[:100] if decoder.needs_input else b""
+                    data = data[len(input):]
+                    chunk = decoder.decode(input, 0x1000)
+                    self.assertLessEqual(len(chunk), 0x1000)
+                    output.extend(chunk)
+                self.assertEqual(body, output)
+
+@patch("net.select", select_timeout)
+class TestHttpDecoded(TestMockHttp):
+    class HTTPConnection(http.client.HTTPConnection):
+        def connect(self):
+            import gzip
+            body = gzip.compress(b"Decoded body\r\n")
+            self.sock = TestHttpSocket.Socket(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Encoding: gzip\r\n"
+                b"Content-Length: " + format(len(body)).encode() + b"\r\n"
+                b"\r\n" + body
+            )
+    
+    def setUp(self):
+        super().setUp()
+        self.handler.accept_encoding = True
+    
+    def test_decode(self):
+        request = urllib.request.Request("mock://localhost/")
+        with self.urlopen(request) as response:
+            self.assertEqual(200, response.status)
+            self.assertEqual(b"Decoded body\r\n", response.read())
+        self.assertEqual(net.ACCEPT_ENCODING,
+            request.get_header("Accept-encoding"))
+    
+    def test_no_body(self):
+        class HTTPConnection(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = TestHttpSocket.Socket(head)
+        entry = {"mock": HTTPConnection}
+        tests = (
+            ("HEAD", b"200 OK", b"Content-Length: 100\r\n"),
+            ("GET", b"204 No Content", b""),
+            ("GET", b"304 Not Modified", b""),
+            ("GET", b"200 OK", b"Content-Length: 0\r\n"),
+        )
+        for [method, status, length] in tests:
+            with self.subTest(method=method, status=status), \
+                    patch.dict(self.handler.conn_classes, entry):
+                head = (b"HTTP/1.1 " + status + b"\r\n"
+                    b"Content-Encoding: gzip\r\n" + length + b"\r\n")
+                request = urllib.request.Request("mock://localhost/",
+                    method=method)
+                with self.handler.default_open(request) as response:
+                    self.assertEqual(b"", response.read())
+
+@patch("net.select", select_timeout)
+class TestHttpPipeline(TestMockHttp):
+    class HTTPConnection(http.client.HTTPConnection):
+        def connect(self):
+            data = TestHttpPipeline.responses.pop(0)
+            self.sock = TestHttpSocket.Socket(data)
+    
+    def setUp(self):
+        super().setUp()
+        self.handler = net.PersistentConnectionHandler(pipeline=4)
+        self.addCleanup(self.handler.close)
+    
+    def request(self, url):
+        self.handler.start_request(urllib.request.Request(url))
+    
+    def test_fifo(self):
+        TestHttpPipeline.responses = [
+            b"HTTP/1.1 200 First response\r\n"
+            b"Content-Length: 12\r\n"
+            b"\r\n"
+            b"First body\r\n"
+            
+            b"HTTP/1.1 200 Second response\r\n"
+            b"Content-Length: 13\r\n"
+            b"\r\n"
+            b"Second body\r\n"
+        ]
+        self.request("mock://localhost/one")
+        self.request("mock://localhost/two")
+        with self.handler.get_response() as response:
+            self.assertEqual("First response", response.reason)
+            self.assertEqual(b"First body\r\n", response.read())
+        with self.handler.get_response() as response:
+            self.assertEqual("Second response", response.reason)
+            self.assertEqual(b"Second body\r\n", response.read())
+        self.assertEqual([], TestHttpPipeline.responses)
+    
+    def test_replay(self):
+        """Test unanswered requests are sent again after closure"""
+        TestHttpPipeline.responses = [
+            b"HTTP/1.1 200 First response\r\n"
+            b"Content-Length: 12\r\n"
+            b"\r\n"
+            b"First body\r\n",
+            
+            b"HTTP/1.1 200 Second response\r\n"
+            b"Content-Length: 13\r\n"
+            b"\r\n"
+            b"Second body\r\n"
+        ]
+        self.request("mock://localhost/one")
+        self.request("mock://localhost/two")
+        with self.handler.get_response() as response:
+            self.assertEqual(b"First body\r\n", response.read())
+        with self.handler.get_response() as response:
+            self.assertEqual(b"Second body\r\n", response.read())
+        self.assertEqual([], TestHttpPipeline.responses)
+
+class TestPipelineEncoding(TestMockHttp):
+    class HTTPConnection(http.client.HTTPConnection):
+        def connect(self):
+            self.sock = TestHttpSocket.Socket(b"")
+            self.sock.sendall = self.sent.append
+        sent = list()
+    
+    def setUp(self):
+        super().setUp()
+        self.handler.pipeline = 4
+        self.HTTPConnection.sent.clear()
+    
+    def test_encoding(self):
+        self.handler.start_request(urllib.request.Request(
+            "mock://b\u00FCcher.example/path", headers={"X-Name": "value"}))
+        [data] = self.HTTPConnection.sent
+        self.assertTrue(data.startswith(b"GET /path HTTP/1.1\r\n"))
+        self.assertIn(b"\r\nHost: xn--bcher-kva.example\r\n", data)
+        self.assertIn(b"\r\nX-name: value\r\n", data)
+    
+    def test_invalid(self):
+        tests = (
+            ("mock://localhost/a b", {}),
+            ("mock://localhost/", {"X-Injected": "a\r\nX-Evil: b"}),
+        )
+        for [url, headers] in tests:
+            with self.subTest(url=url, headers=headers), \
+                    self.assertRaises((ValueError, http.client.InvalidURL)):
+                self.handler.start_request(
+                    urllib.request.Request(url, headers=headers))
+        self.assertEqual([], self.HTTPConnection.sent)
+
+class TestWorkers(TestCase):
+    def test_restart(self):
+        """Test a crashed worker is replaced"""
+        for reuse_port in (False, True):
+            with self.subTest(reuse_port=reuse_port):
+                self.run_workers(reuse_port)
+    
+    def run_workers(self, reuse_port):
+        from socketserver import TCPServer, StreamRequestHandler
+        from threading import Thread
+        import os, signal, socket, time
+        
+        class Handler(StreamRequestHandler):
+            def handle(handler):
+                handler.wfile.write(format(os.getpid()).encode())
+        class Server(net.Server, TCPServer):
+            pass
+        Server.reuse_port = reuse_port
+        
+        server = Server(("localhost", 0), Handler)
+        thread = Thread(target=server.serve_workers, args=(2, 0.05))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.close)
+        
+        def wait_workers(exclude=()):
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                workers = set(server._workers)
+                if len(workers) == 2 and not workers & set(exclude):
+                    return workers
+                time.sleep(0.01)
+            self.fail("Workers not started")
+        def request():
+            # With "reuse_port", a new worker may not be listening yet
+            for _ in range(1000):
+                try:
+                    sock = socket.create_connection(server.server_address)
+                except ConnectionRefusedError:
+                    time.sleep(0.01)
+                    continue
+                with sock:
+                    return int(sock.makefile("rb").read())
+            self.fail("Connection refused")
+        
+        workers = wait_workers()
+        self.assertIn(request(), workers)
+        [crashed, survivor] = workers
+        os.kill(crashed, signal.SIGKILL)
+        workers = wait_workers(exclude={crashed})
+        self.assertIn(survivor, workers)
+        for _ in range(4):
+            self.assertIn(request(), workers)
+        
+        server.close()
+        thread.join()
+        self.assertEqual(set(), server._workers)
+        for pid in workers:
+            with self.assertRaises(ChildProcessError):
+                os.waitpid(pid, os.WNOHANG)
+
+class TestConnectionPool(TestCase):
+    class Connection:
+        def __init__(self):
+            self.closed = False
+        def close(self):
+            self.closed = True
+    
+    def test_limits(self):
+        pool = net.ConnectionPool(max_idle_per_host=2, max_idle=3)
+        connections = list()
+        for key in ("a", "a", "a", "b", "c"):
+            connection = self.Connection()
+            pool.add(key, connection)
+            connections.append(connection)
+        for connection in connections:
+            pool.release(connection)
+        self.assertEqual([True, True, False, False, False],
+            [c.closed for c in connections])
+        self.assertIs(connections[2], pool.get("a"))
+        self.assertIsNone(pool.get("a"))
+    
+    def test_timeout(self):
+        pool = net.ConnectionPool(idle_timeout=10)
+        connection = self.Connection()
+        with patch("net.monotonic", lambda: 1000):
+            pool.add("key", connection)
+            pool.release(connection)
+        with patch("net.monotonic", lambda: 1005):
+            self.assertIs(connection, pool.get("key"))
+            pool.release(connection)
+        with patch("net.monotonic", lambda: 1016):
+            self.assertIsNone(pool.get("key"))
+        self.assertTrue(connection.closed)
 
 class TestHttpEstablishError(TestMockHttp):
     """Connection establishment errors should not trigger a retry"""